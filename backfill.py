@@ -0,0 +1,187 @@
+"""
+Bulk backfill: enriches every page of the database, or a filtered subset, in a single run - without setting
+"Data Fetched" on each page by hand.
+
+    python main.py backfill                              every page
+    python main.py backfill --missing "Release date"     pages where the property is empty
+    python main.py backfill --filter '{"property": "Platform", "select": {"equals": "PC"}}'
+
+    python main.py backfill --database Switch            only one of the configured databases
+
+Pages go through the same pipeline as polled pages, as if "Data Fetched" was set to --option.
+Several databases are backfilled side by side, the worker pool takes turns between them.
+Progress is checkpointed to the data directory after every batch, so an interrupted run resumes where it stopped.
+"""
+import json
+import threading
+import time
+
+import main
+import metrics
+import storage
+
+
+# Per database, "{}" is replaced with the database id
+CHECKPOINT_FILE = "backfill_checkpoint_{}.json"
+
+# Pages handed to the worker pool at once - their IGDB and SteamGrid lookups are batched together
+BATCH_SIZE = 25
+
+# Seconds between two progress reports
+REPORT_INTERVAL = 10
+
+# Oldest pages first, so the order stays the same across resumed runs
+SORTS = [{"timestamp": "created_time", "direction": "ascending"}]
+
+
+def missing_filter(database, property_name):
+    """
+    Filter for the pages where the property is empty - the filter depends on the property type in the database.
+    """
+    properties = database.schema.properties()
+    if properties is None:
+        raise ValueError(f"The schema of the database {database.name} could not be read")
+    if property_name not in properties:
+        raise ValueError(f"The database {database.name} has no property named {property_name!r}")
+    return {"property": property_name, properties[property_name]: {"is_empty": True}}
+
+
+class Progress:
+    """
+    Prints pages/min, the average latency per upstream and an ETA every REPORT_INTERVAL seconds.
+    """
+
+    def __init__(self, total, done, label=""):
+        self.label = label
+        self.total = total
+        self.done = done
+        self.processed = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.latency_at_start = upstream_latency()
+
+    def advance(self, pages):
+        self.done += pages
+        self.processed += pages
+        if time.monotonic() - self.reported >= REPORT_INTERVAL:
+            self.report()
+
+    def report(self):
+        self.reported = time.monotonic()
+        minutes = (self.reported - self.started) / 60
+        rate = self.processed / minutes if minutes > 0 else 0
+
+        line = f"{self.label}{self.done}/{self.total} pages, {rate:.1f} pages/min"
+        if rate > 0:
+            line += f", ETA {format_duration((self.total - self.done) / rate * 60)}"
+
+        latencies = []
+        for upstream, (calls, seconds) in sorted(upstream_latency().items()):
+            calls_before, seconds_before = self.latency_at_start.get(upstream, (0, 0.0))
+            if calls > calls_before:
+                latencies.append(f"{upstream} {(seconds - seconds_before) / (calls - calls_before) * 1000:.0f}ms")
+        if len(latencies) > 0:
+            line += " - " + ", ".join(latencies)
+
+        print(line, flush=True)
+
+
+def upstream_latency():
+    """
+    Returns {upstream: (calls, total seconds)} since the start of the process.
+    """
+    return {dict(labels)['upstream']: totals for labels, totals in metrics.upstream_seconds.totals().items()}
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours > 0 else f"{minutes}m {seconds:02d}s"
+
+
+def run(database, database_filter=None, option=main.LOAD_ALL_OPTION, restart=False, label=""):
+    """
+    Processes every page of the database matching the filter, skipping the pages a previous run with the same filter
+    and option already went through. Returns the number of pages that were updated.
+    """
+    checkpoint_file = CHECKPOINT_FILE.format(database.id)
+    run_key = {'database_id': database.id, 'filter': database_filter, 'option': option}
+    checkpoint = storage.load_json(checkpoint_file, {})
+    if restart or checkpoint.get('run') != run_key:
+        checkpoint = {'run': run_key, 'done': [], 'failed': []}
+
+    # Failed pages are in the dead letters already - the poller retries them
+    skipped = set(checkpoint['done']) | set(checkpoint['failed'])
+
+    pages = [page for results in main.query_database(database, database_filter, sorts=SORTS) for page in results]
+    pending = [page for page in pages if page['id'] not in skipped]
+    print(f"{label}{len(pages)} pages found, {len(pages) - len(pending)} already done", flush=True)
+
+    progress = Progress(len(pages), len(pages) - len(pending), label)
+    updated = 0
+    for i in range(0, len(pending), BATCH_SIZE):
+        batch = pending[i:i + BATCH_SIZE]
+        for page in batch:
+            page['properties']['Data Fetched']['select'] = {"name": option}
+
+        ok = main.page_pool.process(database, batch)
+        updated += len(ok)
+        checkpoint['done'].extend(page['id'] for page in batch if page['id'] in ok)
+        checkpoint['failed'].extend(page['id'] for page in batch if page['id'] not in ok)
+        storage.save_json(checkpoint_file, checkpoint)
+
+        progress.advance(len(batch))
+
+    progress.report()
+    print(f"{label}{updated} pages updated, {len(pending) - updated} failed", flush=True)
+    return updated
+
+
+def run_all(database_list, args):
+    """
+    Backfills the databases side by side, one thread each - the output of each is prefixed with its name.
+    """
+    if len(database_list) == 1:
+        return run(database_list[0], parse_filter(database_list[0], args), args.option, args.restart)
+
+    # Fail on an invalid filter before any database starts
+    filters = [parse_filter(database, args) for database in database_list]
+    updated = [0] * len(database_list)
+
+    def run_one(i):
+        database = database_list[i]
+        try:
+            updated[i] = run(database, filters[i], args.option, args.restart, f"[{database.name}] ")
+        except Exception as e:
+            print(f"[{database.name}] Backfill failed: {type(e).__name__}: {e}", flush=True)
+
+    threads = [threading.Thread(target=run_one, args=(i,)) for i in range(len(database_list))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(updated)
+
+
+def select_databases(ids_or_names):
+    """
+    The served databases matching the given ids or names, every served database if there are none.
+    """
+    if not ids_or_names:
+        return list(main.served_databases)
+
+    selected = []
+    for id_or_name in ids_or_names:
+        database = main.served_databases.find(id_or_name)
+        if database is None:
+            raise ValueError(f"No database {id_or_name!r} is configured")
+        selected.append(database)
+    return selected
+
+
+def parse_filter(database, args):
+    if args.filter is not None:
+        return json.loads(args.filter)
+    if args.missing is not None:
+        return missing_filter(database, args.missing)
+    return None
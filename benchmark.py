@@ -0,0 +1,185 @@
+"""
+Throughput benchmark of the whole pipeline against local stand-ins of every upstream (see mock_upstreams.py).
+Needs no network and no API keys.
+
+    python benchmark.py                                   10, 100 and 5000 pages
+    python benchmark.py --sizes 100 --latency 0.05 --error-rate 0.02 --throttle notion=3
+
+For every database size, all pages are set to "Load All" and one poll is run until the last page is written.
+Reports pages/sec, the p50/p95 latency from a page being returned by the query to its last write, and the requests
+per upstream. The client-side rate limits of http_client apply unless --no-client-limits is given.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import time
+import types
+
+# Keep the cache, tokens and quotas of the benchmark away from the real data directory
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="benchmark-")
+
+# The stand-ins accept any key - a config of its own keeps the benchmark independent of config.py, or its absence
+config = types.ModuleType("config")
+config.STEAM_GRID_KEY = "benchmark"
+config.IGDB_CLIENT_ID = "benchmark"
+config.IGDB_SECRET = "benchmark"
+config.YT_API_KEY = ""
+config.NOTION_API_KEY = "benchmark"
+config.DATABASE_ID = "00000000-0000-4000-8000-000000000000"
+config.DATABASES = []
+sys.modules["config"] = config
+
+import requests
+from howlongtobeatpy.HTMLRequests import HTMLRequests
+
+import http_client
+import igdb
+import main
+import mock_upstreams
+import steamgrid
+import youtube
+from cache import cache
+
+
+DEFAULT_SIZES = (10, 100, 5000)
+
+# Seconds to wait for the pages of a run before giving up on it
+RUN_TIMEOUT = 6 * 60 * 60
+
+
+def point_at(mock):
+    """
+    Sends every request of the script to the stand-ins instead of the real upstreams.
+    """
+    main.NOTION_BASE_URL = f"{mock.base_url(mock_upstreams.NOTION)}/v1"
+    main.served_databases.invalidate()
+    main.STEAM_STORE_URL = f"{mock.base_url(mock_upstreams.STEAM)}/api"
+    main.STEAM_ICONS_URL = mock.base_url(mock_upstreams.STEAMICONS)
+    steamgrid.GRID_BASE_URL = f"{mock.base_url(mock_upstreams.STEAMGRID)}/api/v2"
+    igdb.IGDB_BASE_URL = f"{mock.base_url(mock_upstreams.IGDB)}/v4"
+    igdb.TWITCH_TOKEN_URL = f"{mock.base_url(mock_upstreams.TWITCH)}/oauth2/token"
+    HTMLRequests.SEARCH_URL = f"{mock.base_url(mock_upstreams.HLTB)}/api/search"
+
+    youtube.API_ENDPOINT = f"{mock.base_url(mock_upstreams.YOUTUBE)}/"
+    youtube.DAILY_QUOTA = sys.maxsize
+    youtube.search_service = youtube.YoutubeSearchService(api_key="benchmark")
+
+    # The scraper has youtube.com built in - it is only used after failed API requests
+    scraper_url = f"{mock.base_url(mock_upstreams.YOUTUBE)}/results"
+
+    class ScraperStandIn:
+        def __init__(self, search_terms, max_results=None, **kwargs):
+            self.videos = requests.get(scraper_url, params={'search_query': search_terms}).json()[:max_results]
+
+        def to_dict(self):
+            return self.videos
+
+    youtube.YoutubeSearch = ScraperStandIn
+
+
+def run(size, behaviors):
+    """
+    Processes a fresh database of `size` pages with cold caches and returns the measurements.
+    """
+    database = next(iter(main.served_databases))
+    mock = mock_upstreams.MockUpstreams(mock_upstreams.synthetic_pages(size, database_id=database.id), behaviors).start()
+    try:
+        point_at(mock)
+        cache.clear()
+
+        started = time.monotonic()
+        main.check_and_update_notion(database)
+        while main.page_pool.in_flight() > 0:
+            if time.monotonic() - started > RUN_TIMEOUT:
+                raise TimeoutError(f"{main.page_pool.in_flight()} pages still in flight after {RUN_TIMEOUT}s")
+            time.sleep(0.05)
+        elapsed = time.monotonic() - started
+
+        latencies = [mock.done_at[page_id] - mock.queued_at[page_id] for page_id in mock.done_at
+                     if page_id in mock.queued_at]
+        failed = sum(1 for page in mock.pages.values() if mock_upstreams._select(page) == main.FAILED_OPTION)
+        return {
+            'pages': size,
+            'failed': failed,
+            'seconds': elapsed,
+            'pages_per_second': size / elapsed,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'requests': dict(mock.requests),
+            'responses': {upstream: counts for upstream, counts in mock.responses.items() if counts},
+        }
+    finally:
+        mock.stop()
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    # Linear interpolation between the closest ranks, like statistics.quantiles(method='inclusive') of Python 3.8
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    lower = math.floor(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def print_result(result):
+    if result['p50'] is None:
+        latency = "no page written"
+    else:
+        latency = f"p50 {result['p50']:.3f}s, p95 {result['p95']:.3f}s"
+    print(f"{result['pages']} pages in {result['seconds']:.2f}s - {result['pages_per_second']:.2f} pages/s, "
+          f"{latency}, {result['failed']} failed")
+    for upstream, count in result['requests'].items():
+        if count > 0:
+            statuses = ", ".join(f"{status}: {n}" for status, n in sorted(result['responses'][upstream].items()))
+            print(f"    {upstream:<12} {count:>7} requests ({statuses})")
+
+
+def parse_throttles(values):
+    throttles = {}
+    for value in values:
+        upstream, _, rate = value.partition('=')
+        if upstream not in mock_upstreams.UPSTREAMS or not rate:
+            raise argparse.ArgumentTypeError(f"expected <upstream>=<requests per second>, got {value!r}")
+        throttles[upstream] = float(rate)
+    return throttles
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the pipeline against local stand-ins of all upstreams.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="database sizes to run")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every upstream takes per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- seconds on top of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument("--throttle", action="append", default=[], metavar="UPSTREAM=RPS",
+                        help="answer 429 above this many requests per second (repeatable)")
+    parser.add_argument("--no-client-limits", action="store_true",
+                        help="lift the client-side rate limits of http_client")
+    parser.add_argument("--json", metavar="PATH", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the log of the script")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    throttles = parse_throttles(args.throttle)
+    behaviors = {upstream: mock_upstreams.UpstreamBehavior(args.latency, args.jitter, args.error_rate,
+                                                           throttles.get(upstream))
+                 for upstream in mock_upstreams.UPSTREAMS}
+
+    if args.no_client_limits:
+        http_client._buckets.clear()
+
+    results = []
+    for size in args.sizes:
+        result = run(size, behaviors)
+        print_result(result)
+        results.append(result)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,103 @@
+"""
+Writes page bodies within the limits of Notion's append block children endpoint.
+"""
+import json
+
+import http_client
+
+
+# Limits of a single append request - https://developers.notion.com/reference/request-limits
+MAX_BLOCKS_PER_REQUEST = 100
+MAX_NESTED_BLOCKS_PER_REQUEST = 1000
+MAX_NESTING_DEPTH = 2
+# Notion allows 500KB, the rest is headroom for the encoding of the request
+MAX_PAYLOAD_BYTES = 450 * 1000
+
+
+
+class PartialAppend(Exception):
+    """
+    Appending failed after the first `appended` blocks were written already - resume with `start=appended`.
+    """
+
+    def __init__(self, appended, cause):
+        super().__init__(f"Appended {appended} blocks, then failed: {cause}")
+        self.appended = appended
+        self.cause = cause
+
+
+def count_blocks(block):
+    """
+    The block itself plus all of its nested children.
+    """
+    return 1 + sum(count_blocks(child) for child in _children(block))
+
+
+def nesting_depth(block):
+    children = _children(block)
+    return 0 if len(children) == 0 else 1 + max(nesting_depth(child) for child in children)
+
+
+def _children(block):
+    return block.get(block.get('type'), {}).get('children', [])
+
+
+def _payload_size(block):
+    return len(json.dumps(block).encode('utf-8'))
+
+
+def chunk_blocks(blocks):
+    """
+    Splits the blocks into consecutive chunks that each fit into one append request, keeping their order.
+    """
+    chunk, chunk_blocks_total, chunk_bytes = [], 0, 0
+    for block in blocks:
+        depth, total, size = nesting_depth(block), count_blocks(block), _payload_size(block)
+        if depth > MAX_NESTING_DEPTH or total > MAX_NESTED_BLOCKS_PER_REQUEST or size > MAX_PAYLOAD_BYTES:
+            raise ValueError(f"A {block.get('type')} block is too large for a single request "
+                             f"(depth {depth}, {total} blocks, {size} bytes)")
+
+        if len(chunk) > 0 and (len(chunk) == MAX_BLOCKS_PER_REQUEST
+                               or chunk_blocks_total + total > MAX_NESTED_BLOCKS_PER_REQUEST
+                               or chunk_bytes + size > MAX_PAYLOAD_BYTES):
+            yield chunk
+            chunk, chunk_blocks_total, chunk_bytes = [], 0, 0
+
+        chunk.append(block)
+        chunk_blocks_total += total
+        chunk_bytes += size + 1
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def has_more_children(base_url, block_id, count):
+    """
+    Whether the block has more than `count` children - only requests as many children as needed to tell.
+    """
+    r = http_client.notion().get(f"{base_url}/blocks/{block_id}/children", params={"page_size": count + 1})
+    r.raise_for_status()
+    data = r.json()
+    return len(data['results']) > count or data.get('has_more', False)
+
+
+def append_children(base_url, block_id, blocks, start=0):
+    """
+    Appends blocks[start:] in as few requests as the limits allow, one chunk after the other. Appending is not
+    idempotent, so a failed chunk is not sent again here - if chunks were written before it, PartialAppend tells how
+    many blocks the page has already, counted from the start of `blocks`.
+    Returns the number of requests sent.
+    """
+    requests_sent = 0
+    appended = start
+    for chunk in chunk_blocks(blocks[start:]):
+        r = http_client.notion().patch(f"{base_url}/blocks/{block_id}/children", data=json.dumps({'children': chunk}))
+        requests_sent += 1
+        try:
+            r.raise_for_status()
+        except Exception as e:
+            if appended == 0:
+                raise
+            raise PartialAppend(appended, e) from e
+        appended += len(chunk)
+    return requests_sent
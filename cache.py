@@ -0,0 +1,147 @@
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import storage
+
+
+CACHE_FILE = "cache.sqlite3"
+
+# Number of entries kept in memory in front of the SQLite store
+LRU_SIZE = 2000
+
+DAY = 24 * 60 * 60
+
+# How long a lookup stays valid per source - ratings change more often than names, images and release dates
+TTLS = {
+    "steam": 30 * DAY,
+    "steamicons": 30 * DAY,
+    "steamgrid_id": 30 * DAY,
+    "steamgrid_image": 7 * DAY,
+    "igdb": 3 * DAY,
+    "igdb_game": 3 * DAY,
+    "hltb": 7 * DAY,
+    "hltb_id": 365 * DAY,
+    "youtube": 30 * DAY,
+}
+DEFAULT_TTL = DAY
+
+_MISS = object()
+
+
+def normalize(name):
+    return ' '.join(name.replace(u"®", u"").replace(u"™", u"").lower().split())
+
+
+class Cache:
+    """
+    Two-tier cache for upstream lookups: a bounded in-memory LRU backed by a SQLite file.
+    Values have to be JSON serializable, None is never cached.
+    """
+
+    def __init__(self, path=None, lru_size=LRU_SIZE):
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self._lru_size = lru_size
+
+        self._key_locks = {}
+
+        self._db = sqlite3.connect(path or storage.data_path(CACHE_FILE), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                         "source TEXT, key TEXT, value TEXT, expires REAL, PRIMARY KEY (source, key))")
+        self._db.commit()
+
+    def get(self, source, key):
+        """
+        Returns the cached value or None if it is missing or expired.
+        """
+        value = self.__get(source, str(key))
+        metrics.cache_lookups.inc(source=source, result="miss" if value is _MISS else "hit")
+        return None if value is _MISS else value
+
+    def set(self, source, key, value):
+        if value is None:
+            return
+        key = str(key)
+        expires = time.time() + TTLS.get(source, DEFAULT_TTL)
+
+        with self._lock:
+            self.__remember((source, key), value, expires)
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (source, key, json.dumps(value), expires))
+            self._db.commit()
+
+    def get_or_fetch(self, source, key, fetch, bypass=False):
+        """
+        Returns the cached value, or calls fetch() and caches its result.
+        Concurrent calls for the same key wait for the first one instead of fetching again.
+        With bypass the cached value is ignored (but still replaced by the fresh one).
+        """
+        key = str(key)
+        with self.__key_lock(source, key):
+            if not bypass:
+                value = self.__get(source, key)
+                metrics.cache_lookups.inc(source=source, result="miss" if value is _MISS else "hit")
+                if value is not _MISS:
+                    return value
+            else:
+                metrics.cache_lookups.inc(source=source, result="bypass")
+
+            value = fetch()
+            self.set(source, key, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+    def __get(self, source, key):
+        with self._lock:
+            entry = self._lru.get((source, key))
+            if entry is None:
+                row = self._db.execute("SELECT value, expires FROM entries WHERE source = ? AND key = ?",
+                                       (source, key)).fetchone()
+                if row is None:
+                    return _MISS
+                entry = (json.loads(row[0]), row[1])
+                self.__remember((source, key), *entry)
+
+            value, expires = entry
+            if expires < time.time():
+                del self._lru[(source, key)]
+                return _MISS
+
+            self._lru.move_to_end((source, key))
+            return value
+
+    def __remember(self, lru_key, value, expires):
+        self._lru[lru_key] = (value, expires)
+        self._lru.move_to_end(lru_key)
+        while len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+    @contextlib.contextmanager
+    def __key_lock(self, source, key):
+        # Reference counted, so locks of keys nobody is fetching right now are dropped again
+        with self._lock:
+            lock, users = self._key_locks.get((source, key), (threading.Lock(), 0))
+            self._key_locks[(source, key)] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._key_locks[(source, key)]
+                if users == 1:
+                    del self._key_locks[(source, key)]
+                else:
+                    self._key_locks[(source, key)] = (lock, users - 1)
+
+
+cache = Cache()
@@ -0,0 +1,103 @@
+"""
+The databases served by this process - every entry of config.DATABASES, or just config.DATABASE_ID.
+Upstream lookups are cached per game, not per database, so a title enriched for one gallery is instant for the next.
+"""
+import config
+import schema
+
+
+# Defaults of the options that can be overridden per database in config.DATABASES
+PRIO_ORIGINAL_STEAM_ICONS = False
+
+# Names written instead of the IGDB ones, by IGDB genre/theme id
+GENRE_NAMES = {12: "RPG", 11: "Real Time Strategy", 16: "Turn-based strategy"}
+THEME_NAMES = {41: "4X"}
+
+
+def normalize_id(database_id):
+    """
+    Notion accepts database ids with and without dashes, and returns them with dashes.
+    """
+    return database_id.replace('-', '').lower()
+
+
+def id_from_link(link):
+    return link.split('/')[-1].split('?')[0]
+
+
+def configured():
+    """
+    The entries of config.DATABASES, or a single entry for config.DATABASE_ID if there are none.
+    """
+    return getattr(config, 'DATABASES', None) or [{"database_id": config.DATABASE_ID}]
+
+
+class Database:
+    """
+    One gallery: its id, the options for its pages and its schema, read with `fetch_database(id)`.
+    """
+
+    def __init__(self, fetch_database, database_id=None, link=None, name=None,
+                 prio_original_steam_icons=PRIO_ORIGINAL_STEAM_ICONS, genre_names=None, theme_names=None,
+                 write_page_body=schema.WRITE_PAGE_BODY):
+        if database_id is None and link is None:
+            raise ValueError("A database needs a database_id or a link")
+        self.id = normalize_id(database_id if database_id is not None else id_from_link(link))
+        self.name = name or self.id
+
+        self.prio_original_steam_icons = prio_original_steam_icons
+        self.genre_names = {**GENRE_NAMES, **(genre_names or {})}
+        self.theme_names = {**THEME_NAMES, **(theme_names or {})}
+
+        self.schema = schema.DatabaseSchema(lambda: fetch_database(self.id), write_page_body=write_page_body)
+
+    def __repr__(self):
+        return f"Database({self.name!r})"
+
+
+class Databases:
+    """
+    The served databases by id, in the order they were configured.
+    """
+
+    def __init__(self, fetch_database, entries=None):
+        self._by_id = {}
+        for entry in entries if entries is not None else configured():
+            database = Database(fetch_database, **entry)
+            if database.id in self._by_id:
+                raise ValueError(f"The database {database.id} is configured twice")
+            self._by_id[database.id] = database
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, database_id):
+        return self._by_id.get(normalize_id(database_id))
+
+    def find(self, id_or_name):
+        """
+        Looks a database up by its id or its configured name.
+        """
+        database = self.get(id_or_name)
+        if database is None:
+            database = next((d for d in self._by_id.values() if d.name == id_or_name), None)
+        return database
+
+    def of_page(self, page):
+        """
+        The database a page belongs to, None if it is not one of the served databases.
+        """
+        parent = page['parent']
+        if parent['type'] != 'database_id':
+            return None
+        return self.get(parent['database_id'])
+
+    def invalidate(self):
+        """
+        Makes every database read its schema again.
+        """
+        for database in self._by_id.values():
+            database.schema.invalidate()
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import storage
+
+
+DEAD_LETTER_FILE = "dead_letters.json"
+
+# Retries of a failed page, waiting RETRY_BASE_DELAY * 2^(attempt - 1) seconds (at most RETRY_MAX_DELAY) in between
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+
+class DeadLetterQueue:
+    """
+    Persistent record of pages that failed to process, with the reason, the number of attempts and when to retry.
+    """
+
+    def __init__(self, filename=DEAD_LETTER_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._entries = storage.load_json(filename, {})
+
+    def record(self, page_id, option, reason, permanent=False, appended_blocks=None):
+        """
+        Counts a failed attempt. Returns the entry, its "next_attempt" is None once the page is given up on.
+        `appended_blocks` is the number of body blocks written before the attempt failed, kept until the page is
+        resolved so the retry continues the body instead of starting it over.
+        """
+        with self._lock:
+            entry = self._entries.get(page_id, {"attempts": 0})
+            entry["option"] = option
+            entry["reason"] = reason
+            if appended_blocks is not None:
+                entry["appended_blocks"] = appended_blocks
+            entry["attempts"] += 1
+            entry["failed_at"] = time.time()
+
+            if permanent or entry["attempts"] >= MAX_ATTEMPTS:
+                entry["next_attempt"] = None
+            else:
+                entry["next_attempt"] = time.time() + min(RETRY_MAX_DELAY,
+                                                          RETRY_BASE_DELAY * 2 ** (entry["attempts"] - 1))
+
+            self._entries[page_id] = entry
+            self.__save()
+            return dict(entry)
+
+    def resolve(self, page_id):
+        with self._lock:
+            if self._entries.pop(page_id, None) is not None:
+                self.__save()
+
+    def get(self, page_id):
+        with self._lock:
+            entry = self._entries.get(page_id)
+            return None if entry is None else dict(entry)
+
+    def due(self):
+        """
+        Returns (page_id, entry) of every page whose next retry is due.
+        """
+        now = time.time()
+        with self._lock:
+            return [(page_id, dict(entry)) for page_id, entry in self._entries.items()
+                    if entry["next_attempt"] is not None and entry["next_attempt"] <= now]
+
+    def entries(self):
+        with self._lock:
+            return {page_id: dict(entry) for page_id, entry in self._entries.items()}
+
+    def __save(self):
+        storage.save_json(self.filename, self._entries)
+
+
+dead_letters = DeadLetterQueue()
@@ -0,0 +1,93 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+from cache import cache, normalize
+
+
+# Threads shared by all games for searching the name variants concurrently
+SEARCH_WORKERS = 8
+
+# Seconds a single search may take - howlongtobeatpy sends its requests without a timeout
+SEARCH_TIMEOUT = sum(http_client.TIMEOUT)
+
+_client = None
+_client_lock = threading.Lock()
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+
+
+def client():
+    """
+    howlongtobeatpy is only imported on the first search, deployments without HLTB never load it.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from howlongtobeatpy import HowLongToBeat
+            _client = HowLongToBeat()
+        return _client
+
+
+def strip_non_ascii(string):
+    stripped = (c for c in string if 0 < ord(c) < 127)
+    return ''.join(stripped)
+
+
+def name_variants(name):
+    """
+    The distinct spellings worth searching for - HLTB is picky about special characters and capitalization.
+    """
+    variants = [name, strip_non_ascii(name), name.lower().title(), strip_non_ascii(name).lower().title()]
+    return [variant for variant in dict.fromkeys(variants) if variant.strip()]
+
+
+def _search(game_name):
+    with http_client.limit(http_client.HLTB):
+        return http_client.call_with_timeout(lambda: client().search(game_name), SEARCH_TIMEOUT) or []
+
+
+def _search_id(game_id):
+    with http_client.limit(http_client.HLTB):
+        return http_client.call_with_timeout(lambda: client().search_from_id(game_id), SEARCH_TIMEOUT)
+
+
+def _to_dict(entry):
+    return {
+        'id': entry.game_id,
+        'name': entry.game_name,
+        'web_link': entry.game_web_link,
+        'main_story': entry.main_story,
+        'main_extra': entry.main_extra,
+        'completionist': entry.completionist,
+        'all_styles': entry.all_styles
+    }
+
+
+def resolve(name, refresh=False, known=None):
+    """
+    Returns the times of the best matching HLTB entry as a dict, or None.
+    Once a title was matched, its HLTB id is remembered and later lookups only search the exact HLTB title once.
+    With `known` ({'id': ..., 'name': ...} of an earlier match of the same page), that entry is looked up directly -
+    by its id alone if the name is None, as for pinned pages.
+    """
+    key = normalize(name) if known is None else f"#{known['id']}"
+
+    def fetch():
+        match = known if known is not None else (None if refresh else cache.get("hltb_id", key))
+        if match is not None and match['name'] is None:
+            entry = _search_id(match['id'])
+            return None if entry is None else _to_dict(entry)
+        if match is not None:
+            for entry in _search(match['name']):
+                if entry.game_id == match['id']:
+                    return _to_dict(entry)
+
+        results = [entry for entries in _search_pool.map(_search, name_variants(name)) for entry in entries]
+        if len(results) == 0:
+            return None
+
+        hltb = _to_dict(max(results, key=lambda element: element.similarity))
+        cache.set("hltb_id", normalize(name), {'id': hltb['id'], 'name': hltb['name']})
+        return hltb
+
+    return cache.get_or_fetch("hltb", key, fetch, refresh)
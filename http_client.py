@@ -0,0 +1,261 @@
+import contextlib
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+import metrics
+
+
+# Connection pool per upstream - raise POOL_MAXSIZE if many games are processed in parallel
+POOL_CONNECTIONS = 2
+POOL_MAXSIZE = 10
+
+# (connect, read) in seconds - without a timeout a single stalled socket blocks the poll loop forever
+TIMEOUT = (5, 30)
+
+NOTION = "notion"
+IGDB = "igdb"
+STEAMGRID = "steamgrid"
+STEAM = "steam"
+STEAMICONS = "steamicons"
+
+# Sent by libraries with their own HTTP code, only bounded with limit() and call_with_timeout()
+HLTB = "hltb"
+YOUTUBE = "youtube"
+
+# Maximum number of concurrent requests per upstream, shared by all workers - upstreams missing here are unlimited
+CONCURRENCY_LIMITS = {
+    NOTION: 3,
+    IGDB: 4,
+    STEAMGRID: 4,
+    HLTB: 4,
+    YOUTUBE: 2,
+}
+
+# Sustained requests per second per upstream (token bucket) - upstreams missing here are not rate limited
+RATE_LIMITS = {
+    NOTION: 3,
+    IGDB: 4,
+    STEAMGRID: 10,
+    HLTB: 2,
+    YOUTUBE: 5,
+}
+
+# Retries of a request after a 429, a 5xx or a connection error - with exponential backoff and full jitter
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Requests with other methods may change something, e.g. appending blocks - they are only retried when they were surely
+# not applied: throttled (429), rejected due to a conflicting edit (409) or not even connected. Pass idempotent=True
+# for requests that only read or write the same values again.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+NOT_APPLIED_STATUS_CODES = {409, 429}
+
+DEFAULT_HEADERS = {
+    NOTION: {
+        "Authorization": "Bearer " + config.NOTION_API_KEY,
+        "Content-Type": "application/json",
+        "Notion-Version": "2022-02-22"
+    },
+    STEAMGRID: {'Authorization': f'Bearer {config.STEAM_GRID_KEY}'},
+}
+
+# Overrides of POOL_MAXSIZE / TIMEOUT for single upstreams, e.g. {IGDB: {"timeout": (5, 60)}}
+UPSTREAM_OPTIONS = {}
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Holds back every caller, e.g. after the upstream answered with a Retry-After header.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class UpstreamSession(requests.Session):
+    """
+    Keep-alive session for a single upstream, with its default headers and timeout built in.
+    """
+
+    def __init__(self, upstream, headers=None, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 timeout=TIMEOUT):
+        super().__init__()
+        self.upstream = upstream
+        self.timeout = timeout
+
+        if headers:
+            self.headers.update(headers)
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Sends the request within the rate and concurrency limits of the upstream, retrying throttled (429),
+        failed (5xx) and dropped requests - or, if it is not idempotent, only those that were surely not applied.
+        The last response is returned even if it is still an error.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        retry_status_codes = RETRY_STATUS_CODES if idempotent else NOT_APPLIED_STATUS_CODES
+
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with limit(self.upstream):
+                    r = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == MAX_RETRIES or not (idempotent or isinstance(e, requests.ConnectTimeout)):
+                    raise
+                delay = backoff(attempt)
+                metrics.upstream_retries.inc(upstream=self.upstream, reason=type(e).__name__)
+            else:
+                metrics.upstream_responses.inc(upstream=self.upstream, status=r.status_code)
+                if r.status_code not in retry_status_codes or attempt == MAX_RETRIES:
+                    return r
+                metrics.upstream_retries.inc(upstream=self.upstream, reason=r.status_code)
+                delay = retry_after(r)
+                if delay is not None:
+                    if self.upstream in _buckets:
+                        _buckets[self.upstream].pause(delay)
+                else:
+                    delay = backoff(attempt)
+                logger.info("%s answered %s, retrying in %.1fs", self.upstream, r.status_code, delay)
+
+            time.sleep(delay)
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(r):
+    """
+    Seconds to wait according to the Retry-After header, None if it is missing or an HTTP date.
+    """
+    try:
+        return min(BACKOFF_MAX, float(r.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return None
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_semaphores = {upstream: threading.BoundedSemaphore(n) for upstream, n in CONCURRENCY_LIMITS.items()}
+_buckets = {upstream: TokenBucket(rate) for upstream, rate in RATE_LIMITS.items()}
+
+
+@contextlib.contextmanager
+def limit(upstream):
+    """
+    Waits for the rate limit of an upstream and holds one of its concurrency slots while the block runs.
+    The call is counted and timed in the metrics.
+    """
+    if upstream in _buckets:
+        _buckets[upstream].acquire()
+
+    semaphore = _semaphores.get(upstream)
+    with semaphore if semaphore is not None else contextlib.nullcontext():
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            metrics.upstream_seconds.observe(time.monotonic() - started, upstream=upstream)
+            metrics.upstream_requests.inc(upstream=upstream, outcome=outcome)
+
+
+def call_with_timeout(func, timeout):
+    """
+    Returns func() or raises requests.Timeout if it takes longer than `timeout` seconds - for libraries that send
+    their requests without a timeout. func keeps running on a daemon thread then, only the caller stops waiting.
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = func()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise requests.Timeout(f"No answer within {timeout}s")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+def session(upstream):
+    """
+    Returns the shared session of an upstream, creating it on first use.
+    """
+    with _sessions_lock:
+        if upstream not in _sessions:
+            _sessions[upstream] = UpstreamSession(upstream, DEFAULT_HEADERS.get(upstream),
+                                                  **UPSTREAM_OPTIONS.get(upstream, {}))
+        return _sessions[upstream]
+
+
+def notion():
+    return session(NOTION)
+
+
+def igdb():
+    return session(IGDB)
+
+
+def steamgrid():
+    return session(STEAMGRID)
+
+
+def steam():
+    return session(STEAM)
+
+
+def steamicons():
+    return session(STEAMICONS)
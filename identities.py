@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+
+import storage
+from cache import normalize
+
+
+IDENTITY_FILE = "identities.json"
+
+# Name of a text property to mirror the matched ids into (e.g. "Source IDs"), so they survive a lost data directory.
+# Leave empty to only keep them locally. The property can be hidden in every view.
+IDENTITY_PROPERTY = ""
+
+SOURCES = ("igdb", "steamgrid", "hltb")
+
+
+def match_key(steamid=None, name=None):
+    """
+    What a page was matched by - the ids are only reused as long as the SteamID (or the name) stays the same.
+    """
+    if steamid is not None:
+        return f"steam:{steamid}"
+    return f"name:{normalize(name)}"
+
+
+def dumps(key, ids):
+    return json.dumps(dict(ids, key=key), separators=(',', ':'), sort_keys=True)
+
+
+def from_page(game, key):
+    """
+    Reads the ids mirrored into IDENTITY_PROPERTY, or {} if there are none for this match key.
+    """
+    if not IDENTITY_PROPERTY or IDENTITY_PROPERTY not in game['properties']:
+        return {}
+
+    text = ''.join(t['plain_text'] for t in game['properties'][IDENTITY_PROPERTY].get('rich_text', []))
+    try:
+        stored = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(stored, dict) or stored.get('key') != key:
+        return {}
+    return {source: stored[source] for source in SOURCES if source in stored}
+
+
+class IdentityStore:
+    """
+    Persistent mapping from Notion page id to the ids the page was matched with on IGDB, SteamGrid and HLTB,
+    so later refreshes look the same games up by id instead of searching for the name again.
+    The file is read again once another process (`main.py forget` or `pin`) changed it.
+    """
+
+    def __init__(self, filename=IDENTITY_FILE):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._entries = {}
+        self.__reload()
+
+    def get(self, page_id, key):
+        """
+        Returns the known ids of the page as {source: id}, {} if there are none or the page was matched by a
+        different SteamID or name.
+        """
+        with self._lock:
+            self.__reload()
+            entry = self._entries.get(page_id)
+            if entry is None or entry['key'] != key:
+                return {}
+            return {source: entry[source] for source in SOURCES if source in entry}
+
+    def update(self, page_id, key, ids):
+        with self._lock:
+            self.__reload()
+            entry = {'key': key}
+            entry.update({source: ids[source] for source in SOURCES if ids.get(source) is not None})
+            if self._entries.get(page_id) != entry:
+                self._entries[page_id] = entry
+                self.__save()
+
+    def reset(self, page_id, sources=SOURCES):
+        """
+        Forgets the matches of a page, e.g. after it was matched with the wrong game. Returns the ids that are left.
+        """
+        with self._lock:
+            self.__reload()
+            entry = self._entries.get(page_id)
+            if entry is None:
+                return {}
+            for source in sources:
+                entry.pop(source, None)
+            if not any(source in entry for source in SOURCES):
+                del self._entries[page_id]
+            self.__save()
+            return {source: entry[source] for source in SOURCES if source in entry}
+
+    def __modified(self):
+        try:
+            return os.path.getmtime(storage.data_path(self.filename))
+        except OSError:
+            return None
+
+    def __reload(self):
+        modified = self.__modified()
+        if modified != self._mtime:
+            self._entries = storage.load_json(self.filename, {})
+            self._mtime = modified
+
+    def __save(self):
+        storage.save_json(self.filename, self._entries)
+        self._mtime = self.__modified()
+
+
+identities = IdentityStore()
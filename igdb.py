@@ -0,0 +1,247 @@
+import threading
+import time
+
+import config
+import http_client
+import storage
+from cache import cache, normalize
+
+
+IGDB_BASE_URL = "https://api.igdb.com/v4"
+TWITCH_TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+
+TOKEN_FILE = "twitch_token.json"
+
+# Refresh this many seconds before the token actually expires
+TOKEN_EXPIRY_MARGIN = 300
+
+# Seconds until Twitch is asked for a token again after a failed attempt, e.g. with wrong credentials
+TOKEN_RETRY_DELAY = 60
+
+
+class TokenManager:
+    """
+    Process-wide holder of the Twitch access token used for IGDB.
+    The token is persisted to disk so a restart does not mint a new one.
+    """
+
+    def __init__(self, token_file=TOKEN_FILE):
+        self.token_file = token_file
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0
+        self._retry_at = 0
+
+        stored = storage.load_json(token_file)
+        if stored and stored.get('client_id') == config.IGDB_CLIENT_ID:
+            self._token = stored['access_token']
+            self._expires_at = stored['expires_at']
+
+    def token(self):
+        with self._lock:
+            if self._token is None or time.time() >= self._expires_at - TOKEN_EXPIRY_MARGIN:
+                if time.monotonic() >= self._retry_at:
+                    self.__refresh()
+            return self._token
+
+    def invalidate(self, token):
+        """
+        Drops the token after IGDB rejected it (401), unless another thread already replaced it.
+        """
+        with self._lock:
+            if self._token == token:
+                self._token = None
+
+    def __refresh(self):
+        # Also holds back the next attempt if the request raises
+        self._retry_at = time.monotonic() + TOKEN_RETRY_DELAY
+
+        r = http_client.igdb().post(TWITCH_TOKEN_URL, idempotent=True, params={
+            'client_id': config.IGDB_CLIENT_ID,
+            'client_secret': config.IGDB_SECRET,
+            'grant_type': 'client_credentials'
+        })
+
+        if r.status_code != 200:
+            self._token = None
+            return
+
+        data = r.json()
+        self._retry_at = 0
+        self._token = data['access_token']
+        self._expires_at = time.time() + data['expires_in']
+        storage.save_json(self.token_file, {
+            'client_id': config.IGDB_CLIENT_ID,
+            'access_token': self._token,
+            'expires_at': self._expires_at
+        })
+
+
+token_manager = TokenManager()
+
+
+def igdb_headers(igdb_token=None):
+    if igdb_token is None:
+        igdb_token = token_manager.token()
+    return {'Authorization': f'Bearer {igdb_token}', 'Client-ID': config.IGDB_CLIENT_ID}
+
+
+def post(endpoint, query):
+    """
+    POSTs an apicalypse query to IGDB. Returns None if no token could be obtained.
+    A 401 drops the cached token and retries once with a fresh one.
+    """
+    for _ in range(2):
+        igdb_token = token_manager.token()
+        if igdb_token is None:
+            return None
+
+        r = http_client.igdb().post(f'{IGDB_BASE_URL}/{endpoint}',
+                                    idempotent=True,  # a query, only reads
+                                    data=query.encode('utf-8'),
+                                    headers=igdb_headers(igdb_token))
+        if r.status_code != 401:
+            return r
+
+        token_manager.invalidate(igdb_token)
+
+    return r
+
+
+# IGDB allows at most 10 queries per multiquery request
+MULTIQUERY_MAX_QUERIES = 10
+
+# Games per id lookup ("where id = (...)"), IGDB returns at most 500 results per query
+ID_QUERY_MAX_IDS = 500
+
+# Websites and screenshots are expanded on the game itself, so a single query returns everything we need
+GAME_FIELDS = 'fields *, genres.name, themes.name, involved_companies.company.name, involved_companies.developer, ' \
+              'involved_companies.publisher, websites.category, websites.url, screenshots.url'
+
+
+def _search_key(name):
+    return name.lower()
+
+
+def _escape(name):
+    return name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def pick_game(results, name):
+    """
+    Prefers an exact (case-insensitive) name match over IGDB's search ranking.
+    """
+    try:
+        return results[next(i for i, v in enumerate(results) if v['name'].lower() == name.lower())]
+    except StopIteration:
+        return results[0]
+
+
+class BatchResolver:
+    """
+    Resolves the IGDB games of many names with as few multiquery requests as possible.
+    Call prefetch() with every name queued in a poll cycle, then resolve() each of them individually.
+    Names that were not prefetched are looked up on demand. Search results are cached per name unless refreshed.
+    Games whose IGDB id is already known are fetched by id instead (prefetch_ids() / resolve_id()), without searching.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._games = {}
+
+    def prefetch(self, names, refresh_names=()):
+        refresh_keys = {_search_key(name) for name in refresh_names}
+        with self._lock:
+            pending = list({_search_key(name): name for name in names
+                            if name and _search_key(name) not in self._results}.values())
+
+        pending = [name for name in pending if _search_key(name) in refresh_keys or not self.__load_cached(name)]
+
+        for i in range(0, len(pending), MULTIQUERY_MAX_QUERIES):
+            self.__multiquery(pending[i:i + MULTIQUERY_MAX_QUERIES])
+
+    def resolve(self, name, refresh=False):
+        """
+        Returns the best matching IGDB game (with websites and screenshots expanded) or None.
+        """
+        with self._lock:
+            known = _search_key(name) in self._results
+        if not known and (refresh or not self.__load_cached(name)):
+            self.__multiquery([name])
+
+        with self._lock:
+            results = self._results.get(_search_key(name))
+
+        if not results:
+            return None
+        return pick_game(results, name)
+
+    def prefetch_ids(self, ids, refresh_ids=()):
+        refresh_ids = set(refresh_ids)
+        with self._lock:
+            pending = [igdb_id for igdb_id in dict.fromkeys(ids) if igdb_id not in self._games]
+
+        pending = [igdb_id for igdb_id in pending if igdb_id in refresh_ids or not self.__load_cached_game(igdb_id)]
+
+        for i in range(0, len(pending), ID_QUERY_MAX_IDS):
+            self.__query_ids(pending[i:i + ID_QUERY_MAX_IDS])
+
+    def resolve_id(self, igdb_id, refresh=False):
+        """
+        Returns the IGDB game with this id (with websites and screenshots expanded) or None.
+        """
+        with self._lock:
+            known = igdb_id in self._games
+        if not known and (refresh or not self.__load_cached_game(igdb_id)):
+            self.__query_ids([igdb_id])
+
+        with self._lock:
+            return self._games.get(igdb_id)
+
+    def __query_ids(self, ids):
+        r = post('games', f'{GAME_FIELDS}; where id = ({",".join(str(igdb_id) for igdb_id in ids)}); limit {len(ids)};')
+
+        games = {igdb_id: None for igdb_id in ids}
+        if r is not None and r.status_code == 200:
+            for game in r.json():
+                games[game['id']] = game
+                cache.set("igdb_game", game['id'], game)
+
+        with self._lock:
+            self._games.update(games)
+
+    def __load_cached_game(self, igdb_id):
+        game = cache.get("igdb_game", igdb_id)
+        if game is None:
+            return False
+
+        with self._lock:
+            self._games[igdb_id] = game
+        return True
+
+    def __multiquery(self, names):
+        query = ''.join(f'query games "{i}" {{ {GAME_FIELDS}; search "{_escape(name)}"; }};'
+                        for i, name in enumerate(names))
+        r = post('multiquery', query)
+
+        # Failed lookups are remembered as empty so the same cycle does not retry them for every page
+        results = {_search_key(name): [] for name in names}
+        if r is not None and r.status_code == 200:
+            for named_result in r.json():
+                results[_search_key(names[int(named_result['name'])])] = named_result['result']
+
+                if len(named_result['result']) > 0:
+                    cache.set("igdb", normalize(names[int(named_result['name'])]), named_result['result'])
+
+        with self._lock:
+            self._results.update(results)
+
+    def __load_cached(self, name):
+        results = cache.get("igdb", normalize(name))
+        if results is None:
+            return False
+
+        with self._lock:
+            self._results[_search_key(name)] = results
+        return True
@@ -1,445 +1,950 @@
+import argparse
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
+import logging
 import time
 import math
-
-from howlongtobeatpy import HowLongToBeat
-import googleapiclient.discovery, googleapiclient.errors
-from youtube_search import YoutubeSearch
-
-import config
-
-
-PRIO_ORIGINAL_STEAM_ICONS = False
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import blocks
+import databases
+import http_client
+from cache import cache
+import hltb
+import identities as identity_store
+import igdb
+import metrics
+import providers
+import schema
+import steam_catalog
+import steamgrid
+import storage
+import youtube
+from deadletter import dead_letters
+from identities import identities
+from scheduler import FairScheduler
+
+
+# IGDB image size of the screenshots in the page body, e.g. "t_screenshot_big" (889x500) for lighter pages
+SCREENSHOT_SIZE = "t_original"
+
+# Pages with more blocks than this already have a body, which is left as it is
+EXISTING_BODY_BLOCKS = 5
+
+# Threads per game for fetching the independent sources concurrently - the graph has at most 7 tasks in flight
+FANOUT_WORKERS = 8
+
+# Number of pages processed concurrently
+PAGE_WORKERS = 4
+
+# Batches (result pages of a query) waiting for the workers - a poll that finds more blocks until one is done,
+# instead of reading a whole backlog into memory at once
+MAX_PENDING_BATCHES = 8
+
+# Results per database query request (Notion allows at most 100)
+QUERY_PAGE_SIZE = 100
+
+# Poll interval in seconds - reset to the minimum after activity, multiplied by POLL_BACKOFF while idle
+MIN_POLL_INTERVAL = 3
+MAX_POLL_INTERVAL = 60
+POLL_BACKOFF = 1.5
+
+# Overlap of consecutive incremental polls, and how often to run a full poll regardless of the watermark
+WATERMARK_MARGIN = 120
+FULL_POLL_INTERVAL = 15 * 60
+
+POLL_STATE_FILE = "poll_state.json"
 
 LOAD_ALL_OPTION = "Load All"
 LOAD_IMAGES_OPTION = "Load Images"
+REFRESH_ALL_OPTION = "Refresh All"  # Same as "Load All", but ignores cached lookups
+FAILED_OPTION = "Failed"
 
-GRID_BASE_URL = "https://www.steamgriddb.com/api/v2"
-IGDB_BASE_URL = "https://api.igdb.com/v4"
 NOTION_BASE_URL = "https://api.notion.com/v1"
+STEAM_STORE_URL = "http://store.steampowered.com/api"
+STEAM_ICONS_URL = "https://steamicons.adriansteffan.com"
 
-steamgrid_headers = {'Authorization': f'Bearer {config.STEAM_GRID_KEY}'}
-
-notion_headers = headers = {
-    "Authorization": "Bearer " + config.NOTION_API_KEY,
-    "Content-Type": "application/json",
-    "Notion-Version": "2022-02-22"
-}
-
-
-def igdb_headers(igdb_token):
-    return {'Authorization': f'Bearer {igdb_token}', 'Client-ID': config.IGDB_CLIENT_ID}
-
+# Answers of Notion for pages that were deleted or are no longer shared with the integration
+GONE_STATUS_CODES = {403, 404}
 
-def strip_non_ascii(string):
-    stripped = (c for c in string if 0 < ord(c) < 127)
-    return ''.join(stripped)
+logger = logging.getLogger(__name__)
 
 
 def cleanup_name(name):
     return name.replace(u"®", u"").replace(u"™", u"")
 
 
-def get_yt_id_by_name(name):
-    fallback_scraping = False
-    if config.YT_API_KEY != "":
-        youtube = googleapiclient.discovery.build('youtube', 'v3', developerKey=config.YT_API_KEY)
-        yt_req = youtube.search().list(q=f'{name} Trailer', part='snippet', type='video', maxResults=1)
-        try:
-            video_id = yt_req.execute()['items'][0]['id']['videoId']
-            return video_id
-        except googleapiclient.errors.HttpError:
-            fallback_scraping = True
-
-    if fallback_scraping or config.YT_API_KEY == "":
-        results = YoutubeSearch(f'{name} Trailer', max_results=10).to_dict()
-        if len(results) > 0:
-            return results[0]['id']
+class PageFailure(Exception):
+    """
+    A page that can not be processed. Permanent failures are not retried, as they need a fix on the page itself.
+    """
 
-    return None
+    def __init__(self, reason, permanent=False):
+        super().__init__(reason)
+        self.permanent = permanent
 
 
 def fail_notion(page_id):
-    requests.patch(
+    r = http_client.notion().patch(
         f"{NOTION_BASE_URL}/pages/{page_id}",
-        headers=notion_headers,
+        idempotent=True,
         data=json.dumps({
             "properties": {
                 "Data Fetched": {
                     "select": {
-                        "name": "Yes"
+                        "name": FAILED_OPTION
                     }
                 }
             }
         })
     )
+    r.raise_for_status()
+
+
+def query_database(database, database_filter=None, page_size=QUERY_PAGE_SIZE, sorts=None):
+    """
+    Follows the cursors of a database query and yields each page of results as soon as it arrives.
+    Without a filter, every page of the database is returned.
+    """
+    query = {
+        "page_size": page_size
+    }
+    if database_filter is not None:
+        query["filter"] = database_filter
+    if sorts is not None:
+        query["sorts"] = sorts
 
-def check_and_update_notion():
-    r_db = requests.post(
-        f"{NOTION_BASE_URL}/databases/{config.DATABASE_ID}/query",
-        headers=notion_headers,
-        data=json.dumps({
-            "filter": {
-                "or": [
-                    {
-                        "property": "Data Fetched",
-                        "select": {
-                            "equals": LOAD_IMAGES_OPTION
-                        }
-                    },
-                    {
-                        "property": "Data Fetched",
-                        "select": {
-                            "equals": LOAD_ALL_OPTION
-                        }
-                    }
-                ]
+    while True:
+        r_db = http_client.notion().post(
+            f"{NOTION_BASE_URL}/databases/{database.id}/query",
+            idempotent=True,  # a query, only reads
+            data=json.dumps(query)
+        )
 
+        if r_db.status_code != 200:
+            logger.warning("Querying the database failed with %s: %s", r_db.status_code, r_db.text)
+        r_db.raise_for_status()
+
+        data = r_db.json()
+        yield data['results']
+
+        if not data['has_more']:
+            return
+        query["start_cursor"] = data['next_cursor']
+
+
+def check_and_update_notion(database, edited_since=None):
+    """
+    Queues every page of the database that is set to one of the load options - only those edited since
+    `edited_since` if given.
+    Returns the number of pages found.
+    """
+    database_filter = {
+        "or": [
+            {
+                "property": "Data Fetched",
+                "select": {
+                    "equals": LOAD_IMAGES_OPTION
+                }
+            },
+            {
+                "property": "Data Fetched",
+                "select": {
+                    "equals": LOAD_ALL_OPTION
+                }
+            },
+            {
+                "property": "Data Fetched",
+                "select": {
+                    "equals": REFRESH_ALL_OPTION
+                }
             }
-        })
+        ]
+    }
+
+    if edited_since is not None:
+        database_filter = {
+            "and": [
+                database_filter,
+                {
+                    "timestamp": "last_edited_time",
+                    "last_edited_time": {
+                        "on_or_after": edited_since
+                    }
+                }
+            ]
+        }
+
+    # Each result page is processed while the next one is still being fetched
+    found = 0
+    with metrics.span("query"):
+        for results in query_database(database, database_filter):
+            page_pool.submit(database, results)
+            found += len(results)
+    return found
+
+
+class Poller:
+    """
+    Polls every database for pages edited since its last poll (its watermark, persisted across restarts).
+    The interval is short right after activity in any database and backs off while all of them are idle.
+    Every FULL_POLL_INTERVAL seconds the watermark of a database is ignored once, to pick up pages that were left
+    behind.
+    """
+
+    def __init__(self, database_list=None, state_file=POLL_STATE_FILE, min_interval=MIN_POLL_INTERVAL,
+                 max_interval=MAX_POLL_INTERVAL):
+        self.databases = list(database_list if database_list is not None else served_databases)
+        self.state_file = state_file
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+        state = storage.load_json(state_file, {})
+        state = {databases.normalize_id(database_id): watermark for database_id, watermark in state.items()}
+        self.watermarks = {database.id: state.get(database.id) for database in self.databases}
+
+        # A restored watermark continues incrementally, the first full poll follows after FULL_POLL_INTERVAL
+        self.last_full_poll = {database.id: time.monotonic() for database in self.databases}
+
+    def poll(self):
+        found = 0
+        for database in self.databases:
+            try:
+                found += self.__poll_database(database)
+            except requests.RequestException:
+                # An unreachable database only skips this cycle, without holding up the others
+                logger.warning("Polling the database %s failed", database.name, exc_info=True)
+        retry_dead_letters()
+
+        storage.save_json(self.state_file, self.watermarks)
+
+        if found > 0 or page_pool.in_flight() > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * POLL_BACKOFF)
+        return found
+
+    def __poll_database(self, database):
+        started = datetime.now(timezone.utc)
+
+        watermark = self.watermarks[database.id]
+        full_poll = watermark is None or time.monotonic() - self.last_full_poll[database.id] >= FULL_POLL_INTERVAL
+        found = check_and_update_notion(database, None if full_poll else watermark)
+
+        if full_poll:
+            self.last_full_poll[database.id] = time.monotonic()
+
+        # Notion rounds last_edited_time to the minute, the margin also absorbs clock skew
+        self.watermarks[database.id] = (started - timedelta(seconds=WATERMARK_MARGIN)).isoformat()
+        return found
+
+    def run(self):
+        # Delaying for x seconds after execution instead of executing every x seconds is actually the intended
+        # behavior in order to avoid collisions if the Notion API takes longer x seconds to respond.
+        while True:
+            try:
+                self.poll()
+            except requests.RequestException:
+                pass  # timeouts and connection errors only skip this cycle, the pages are picked up again on the next one
+            time.sleep(self.interval)
+
+
+def identify_page(database, game, igdb_resolver, steamgrid_batch=None):
+    """
+    Resolves the name of a queued page and returns its GameData. Raises PageFailure if the page can not be identified.
+    """
+    key = page_match_key(game)
+    identity = identities.get(game['id'], key) or identity_store.from_page(game, key)
+
+    gd = GameData(igdb_resolver, steamgrid_batch, refresh=page_option(game) == REFRESH_ALL_OPTION, identity=identity,
+                  prio_original_steam_icons=database.prio_original_steam_icons)
+    gd.match_key = key
+    with metrics.span("identify", gd.timings):
+        _identify_page(game, gd)
+    gd.has_body = page_has_body(database, game, gd.timings)
+    return gd
+
+
+def page_has_body(database, game, timings=None):
+    """
+    Whether the page has a body of its own, which is kept - the sources only the body needs are not fetched for it.
+    A partial body an earlier attempt left behind does not count, it is continued instead.
+    """
+    if page_option(game) == LOAD_IMAGES_OPTION or not database.schema.write_page_body:
+        return False
+    if (dead_letters.get(game['id']) or {}).get('appended_blocks', 0) > 0:
+        return False
+    with metrics.span("read_body", timings):
+        return blocks.has_more_children(NOTION_BASE_URL, game['id'], EXISTING_BODY_BLOCKS)
+
+
+def page_steamid(game):
+    rt = game['properties']['SteamID']['rich_text']
+    if len(rt) == 0 or not rt[0]['plain_text'].isdigit():
+        return None
+    return rt[0]['plain_text']
+
+
+def page_match_key(game):
+    title_list = game['properties']['Name']['title']
+    return identity_store.match_key(page_steamid(game), title_list[0]['plain_text'] if len(title_list) > 0 else "")
+
+
+def forget_matches(page_id, sources=identity_store.SOURCES):
+    """
+    Drops the IGDB/SteamGrid/HLTB matches of a page and sets it to "Refresh All", so the next update searches for
+    the game again without the cached search results that led to the old match.
+    """
+    game = fetch_page(page_id)
+    key = page_match_key(game)
+    identities.reset(page_id, sources)
+    ids = {source: value for source, value in identity_store.from_page(game, key).items() if source not in sources}
+    refresh_with_identity(page_id, key, ids)
+
+
+def pin_matches(page_id, ids):
+    """
+    Matches a page with the given {source: id} instead of what the search found, and sets it to "Refresh All".
+    """
+    game = fetch_page(page_id)
+    key = page_match_key(game)
+    ids = dict(identities.get(page_id, key) or identity_store.from_page(game, key), **ids)
+    identities.update(page_id, key, ids)
+    refresh_with_identity(page_id, key, ids)
+
+
+def refresh_with_identity(page_id, key, ids):
+    properties = {"Data Fetched": {"select": {"name": REFRESH_ALL_OPTION}}}
+    if identity_store.IDENTITY_PROPERTY:
+        properties[identity_store.IDENTITY_PROPERTY] = {
+            "rich_text": [{"text": {"content": identity_store.dumps(key, ids)}}] if ids else []
+        }
+
+    r = http_client.notion().patch(
+        f"{NOTION_BASE_URL}/pages/{page_id}",
+        idempotent=True,
+        data=json.dumps({"properties": properties})
     )
+    r.raise_for_status()
 
-    if r_db.status_code != 200:
-        return
 
-    for game in r_db.json()['results']:
-        gd = GameData()
-        rt = game['properties']['SteamID']['rich_text']
-        if len(rt) == 0 or not rt[0]['plain_text'].isdigit():
-            title_list = game['properties']['Name']['title']
-            if len(title_list) == 0:  # failure state
-                fail_notion(game['id'])
-                return
-            gd.fetch_data_by_name(title_list[0]['plain_text'])
+def _identify_page(game, gd):
+    steamid = page_steamid(game)
+    if steamid is None:
+        title_list = game['properties']['Name']['title']
+        if len(title_list) == 0:  # failure state
+            raise PageFailure("The page has neither a SteamID nor a name", permanent=True)
+        gd.identify_by_name(title_list[0]['plain_text'])
+        return gd
 
-        else:
-            gd.fetch_data_by_steamid(rt[0]['plain_text'])
+    if not gd.identify_by_steamid(steamid):
+        raise PageFailure(f"Steam has no data for the SteamID {steamid}")
+    return gd
 
-        update_data = {
-            "properties": {
-                "Data Fetched": {
-                    "select": {
-                        "name": "Yes"
+
+def retry_dead_letters():
+    """
+    Queues the failed pages whose next retry is due, with the option they originally failed with.
+    Pages that were changed by hand, deleted or unshared in the meantime are dropped from the dead letters.
+    """
+    for page_id, entry in dead_letters.due():
+        try:
+            game = fetch_page(page_id)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in GONE_STATUS_CODES:
+                logger.warning("Reading the failed page %s failed, retrying on the next poll", page_id)
+                return  # e.g. an outage of Notion - the other pages would fail the same way
+            dead_letters.resolve(page_id)
+            continue
+
+        database = served_databases.of_page(game)
+        select = game['properties']['Data Fetched']['select']
+        if database is None or select is None or select['name'] != FAILED_OPTION:
+            dead_letters.resolve(page_id)
+            continue
+
+        game['properties']['Data Fetched']['select'] = {"name": entry['option']}
+        page_pool.submit(database, [game])
+
+
+def page_option(game):
+    return game['properties']['Data Fetched']['select']['name']
+
+
+def add_image_properties(update_data, gd):
+    if gd.front is not None:
+        update_data['properties']['Grid'] = {
+            "files": [
+                {
+                    "type": "external",
+                    "name": "test.jpg",
+                    "external": {
+                        "url": gd.front
                     }
-                },
-                "Name": {
-                    "title": [
-                        {"text": {"content": gd.name}}
-                    ]
-                },
+                }
+            ]
+        }
+
+    if gd.icon is not None:
+        update_data['icon'] = {
+            "type": "external",
+            "external": {
+                "url": gd.icon
             }
         }
 
-        if len(gd.genres) > 0:
-            dico = {12: "RPG", 11: "Real Time Strategy", 16: "Turn-based strategy"}
-            update_data["properties"]["Genre"] = {}
-            genres_json = []
-            for genre in gd.genres:
-                if genre["id"] in dico:
-                    genres_json.append({"name": dico[genre["id"]].replace(",", "")})
-                else:
-                    genres_json.append({"name": genre["name"].replace(",", "")})
-            update_data["properties"]["Genre"]["multi_select"] = genres_json
-
-        if len(gd.themes) > 0:
-            dico = {41: "4X"}
-            update_data["properties"]["Theme"] = {}
-            themes_json = []
-            for theme in gd.themes:
-                if theme["id"] in dico:
-                    themes_json.append({"name": dico[theme["id"]].replace(",", "")})
-                else:
-                    themes_json.append({"name": theme["name"].replace(",", "")})
-            update_data["properties"]["Theme"]["multi_select"] = themes_json
-
-        if len(gd.developers) > 0:
-            update_data["properties"]["Developer"] = {}
-            developers_json = []
-            for developer in gd.developers:
-                developers_json.append({"name": developer["company"]["name"].replace(",", "")})
-            update_data["properties"]["Developer"]["multi_select"] = developers_json
-
-        if len(gd.publishers) > 0:
-            update_data["properties"]["Publisher"] = {}
-            publishers_json = []
-            for publisher in gd.publishers:
-                publishers_json.append({"name": publisher["company"]["name"].replace(",", "")})
-            update_data["properties"]["Publisher"]["multi_select"] = publishers_json
-
-        if gd.time_to_beat_all_styles is not None:
-            update_data['properties']['How Long to Beat'] = {}
-            update_data['properties']['How Long to Beat']['number'] = gd.time_to_beat_all_styles
-
-        if gd.release_date_iso is not None:
-            update_data['properties']['Release date'] = {
-                "date": {
-                    "start": gd.release_date_iso
+    if gd.hero is not None:
+        update_data['cover'] = {
+            "type": "external",
+            "external": {
+                "url": gd.hero
+            }
+        }
+
+
+def add_identity_property(update_data, gd):
+    if identity_store.IDENTITY_PROPERTY and gd.match_key is not None:
+        update_data['properties'][identity_store.IDENTITY_PROPERTY] = {
+            "rich_text": [{"text": {"content": identity_store.dumps(gd.match_key, gd.identity)}}]
+        }
+
+
+def comparable_value(prop):
+    """
+    Reduces a property (or icon/cover) to what is visible, so values read from Notion and values about to be written
+    can be compared.
+    """
+    if prop is None:
+        return None
+    if 'title' in prop:
+        return ''.join(t['plain_text'] if 'plain_text' in t else t['text']['content'] for t in prop['title'])
+    if 'rich_text' in prop:
+        return ''.join(t['plain_text'] if 'plain_text' in t else t['text']['content'] for t in prop['rich_text'])
+    if 'multi_select' in prop:
+        return [option['name'] for option in prop['multi_select'] or []]
+    if 'select' in prop:
+        return (prop['select'] or {}).get('name')
+    if 'number' in prop:
+        return prop['number']
+    if 'date' in prop:
+        return (prop['date'] or {}).get('start')
+    if 'files' in prop:
+        return [f[f.get('type', 'external')]['url'] for f in prop['files']]
+    if 'external' in prop:
+        return prop['external']['url']
+    if 'file' in prop:
+        return prop['file']['url']
+    return prop
+
+
+def minimal_update(game, update_data):
+    """
+    Drops everything from update_data that already has the same value on the page.
+    """
+    minimal = {"properties": {}}
+
+    for name, prop in update_data.get('properties', {}).items():
+        if comparable_value(game['properties'].get(name)) != comparable_value(prop):
+            minimal["properties"][name] = prop
+
+    for key in ('icon', 'cover'):
+        if key in update_data and comparable_value(game.get(key)) != comparable_value(update_data[key]):
+            minimal[key] = update_data[key]
+
+    if len(minimal["properties"]) == 0:
+        del minimal["properties"]
+    return minimal
+
+
+def patch_page(database, game, update_data, timings=None):
+    """
+    Only writes the properties that actually changed, and nothing at all if the page is already up to date.
+    """
+    update_data = minimal_update(game, database.schema.filter(update_data))
+    if len(update_data) == 0:
+        return
+
+    with metrics.span("write_properties", timings):
+        r_page_props = http_client.notion().patch(
+            f"{NOTION_BASE_URL}/pages/{game['id']}",
+            idempotent=True,  # sets the properties, writing them twice does no harm
+            data=json.dumps(update_data)
+        )
+    r_page_props.raise_for_status()
+
+
+def update_page_images(database, game, gd):
+    """
+    Fast path for "Load Images" - only resolves icon, grid and hero and writes nothing else.
+    """
+    with metrics.span("fetch_images", gd.timings):
+        gd.fetch_images()
+
+    update_data = {
+        "properties": {
+            "Data Fetched": {
+                "select": {
+                    "name": "Yes"
                 }
             }
+        }
+    }
+    add_image_properties(update_data, gd)
+    add_identity_property(update_data, gd)
 
-        if gd.igdb_rating is not None:
-            update_data['properties']["IGDB Rating"] = {
-                "number": round(gd.igdb_rating, 0)
+    patch_page(database, game, update_data, gd.timings)
+
+
+def update_page(database, game, gd):
+    if page_option(game) == LOAD_IMAGES_OPTION:
+        update_page_images(database, game, gd)
+        return
+
+    with metrics.span("fetch", gd.timings):
+        gd.fetch_remaining_data(database.schema.sources(page_body=not gd.has_body))
+
+    update_data = {
+        "properties": {
+            "Data Fetched": {
+                "select": {
+                    "name": "Yes"
+                }
+            },
+            "Name": {
+                "title": [
+                    {"text": {"content": gd.name}}
+                ]
+            },
+        }
+    }
+
+    if len(gd.genres) > 0:
+        dico = database.genre_names
+        update_data["properties"]["Genre"] = {}
+        genres_json = []
+        for genre in gd.genres:
+            if genre["id"] in dico:
+                genres_json.append({"name": dico[genre["id"]].replace(",", "")})
+            else:
+                genres_json.append({"name": genre["name"].replace(",", "")})
+        update_data["properties"]["Genre"]["multi_select"] = genres_json
+
+    if len(gd.themes) > 0:
+        dico = database.theme_names
+        update_data["properties"]["Theme"] = {}
+        themes_json = []
+        for theme in gd.themes:
+            if theme["id"] in dico:
+                themes_json.append({"name": dico[theme["id"]].replace(",", "")})
+            else:
+                themes_json.append({"name": theme["name"].replace(",", "")})
+        update_data["properties"]["Theme"]["multi_select"] = themes_json
+
+    if len(gd.developers) > 0:
+        update_data["properties"]["Developer"] = {}
+        developers_json = []
+        for developer in gd.developers:
+            developers_json.append({"name": developer["company"]["name"].replace(",", "")})
+        update_data["properties"]["Developer"]["multi_select"] = developers_json
+
+    if len(gd.publishers) > 0:
+        update_data["properties"]["Publisher"] = {}
+        publishers_json = []
+        for publisher in gd.publishers:
+            publishers_json.append({"name": publisher["company"]["name"].replace(",", "")})
+        update_data["properties"]["Publisher"]["multi_select"] = publishers_json
+
+    if gd.time_to_beat_all_styles is not None:
+        update_data['properties']['How Long to Beat'] = {}
+        update_data['properties']['How Long to Beat']['number'] = gd.time_to_beat_all_styles
+
+    if gd.release_date_iso is not None:
+        update_data['properties']['Release date'] = {
+            "date": {
+                "start": gd.release_date_iso
             }
+        }
+
+    if gd.igdb_rating is not None:
+        update_data['properties']["IGDB Rating"] = {
+            "number": round(gd.igdb_rating, 0)
+        }
+
+    add_image_properties(update_data, gd)
+    add_identity_property(update_data, gd)
 
-        if gd.front is not None:
-            update_data['properties']['Grid'] = {
-                "files": [
+    patch_page(database, game, update_data, gd.timings)
+
+    if not database.schema.write_page_body or gd.has_body:
+        return
+
+    # Update page content
+
+    page_children = []
+
+    def text_block(text):
+        return {
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [
                     {
-                        "type": "external",
-                        "name": "test.jpg",
-                        "external": {
-                            "url": gd.front
+                        "type": "text",
+                        "text": {
+                            "content": text[:2000],  # Length limit on rich text content - undocumented a of now
                         }
                     }
                 ]
             }
+        }
 
-        if gd.icon is not None:
-            update_data['icon'] = {
-                "type": "external",
-                "external": {
-                    "url": gd.icon
-                }
+    def link_block(text, url):
+        return {
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [
+                    {
+                        "type": "text",
+                        "text": {
+                            "content": text,
+                            "link": {"url": url}
+                        }
+                    }
+                ]
+            }
+        }
+
+    def callout_block(text, emoji, color="default"):
+        return {
+            "object": "block",
+            "type": "callout",
+            "callout": {
+                "rich_text": [{
+                    "type": "text",
+                    "text": {
+                        "content": text,
+                    },
+                }],
+                "icon": {
+                    "emoji": emoji
+                },
+                "color": color
             }
+        }
 
-        if gd.hero is not None:
-            update_data['cover'] = {
+    def ext_img_block(url):
+        return {
+            "object": "block",
+            "type": "image",
+            "image": {
                 "type": "external",
                 "external": {
-                    "url": gd.hero
+                    "url": url
                 }
             }
+        }
 
-        r_page_props = requests.patch(
-            f"{NOTION_BASE_URL}/pages/{game['id']}",
-            headers=notion_headers,
-            data=json.dumps(update_data)
-        )
+    if gd.release_date is not None:
+        page_children.append(text_block(f"Release Date: {gd.release_date}"))
 
-        # Update page content
+    if gd.wikipedia_link is not None:
+        page_children.append(link_block("Wikipedia", gd.wikipedia_link))
 
-        page_children = []
+    if gd.igdb_description is not None:
+        page_children.append(text_block(gd.igdb_description))
 
-        def text_block(text):
-            return {
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": text[:2000],  # Length limit on rich text content - undocumented a of now
-                            }
-                        }
-                    ]
-                }
+    if gd.time_to_beat_weblink is not None:
+
+        page_children.append(text_block(" "))
+        page_children.append({
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [
+                    {
+                        "type": "text",
+                        "text": {
+                            "content": "How Long To Beat Data:",
+                            "link": {"url": gd.time_to_beat_weblink}
+                        },
+                        "annotations": {
+                            "bold": False,
+                            "italic": False,
+                            "strikethrough": False,
+                            "underline": True,
+                            "code": False,
+                            "color": "default"
+                        },
+                    }
+                ]
             }
+        })
 
-        def link_block(text, url):
-            return {
+        page_children.append({
+            "object": "block",
+            "type": "column_list",
+            "column_list": {
+                "children": [
+                    {
+                        "object": "block",
+                        "type": "column",
+                        "column": {"children": [
+                            callout_block(f"Normal: {gd.time_to_beat_main}", "🏁", "yellow_background")
+                        ]}
+                    },
+                    {
+                        "object": "block",
+                        "type": "column",
+                        "column": {"children": [
+                            callout_block(f"Main+Extra: {gd.time_to_beat_extra}", "📌", "yellow_background")
+                        ]}
+                    },
+                    {
+                        "object": "block",
+                        "type": "column",
+                        "column": {"children": [
+                            callout_block(f" Completion: {gd.time_to_beat_completionist}", "✅", "yellow_background")
+                        ]}
+                    },
+                ]
+            }
+        })
+
+    if gd.yt_trailer is not None:
+        page_children.append(text_block(" "))
+        page_children.append({
+            "object": "block",
+            "type": "video",
+            "video": {
+            "type": "external",
+            "external": {
+                "url": gd.yt_trailer
+            }
+            }
+        })
+
+    if gd.igdb_images is not None:
+
+        # the spacing of two separate columns looks off, so we are using rows of columns instead
+
+        for i in range(1, len(gd.igdb_images), 2):
+            page_children.append({
                 "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
+                "type": "column_list",
+                "column_list": {
+                    "children": [
                         {
-                            "type": "text",
-                            "text": {
-                                "content": text,
-                                "link": {"url": url}
-                            }
-                        }
+                            "object": "block",
+                            "type": "column",
+                            "column": {"children": [ext_img_block(gd.igdb_images[i - 1])]}
+                        },
+                        {
+                            "object": "block",
+                            "type": "column",
+                            "column": {"children": [ext_img_block(gd.igdb_images[i])]}
+                        },
                     ]
                 }
-            }
+            })
 
-        def callout_block(text, emoji, color="default"):
-            return {
+        if len(gd.igdb_images) % 2 != 0:
+            page_children.append({
                 "object": "block",
-                "type": "callout",
-                "callout": {
-                    "rich_text": [{
-                        "type": "text",
-                        "text": {
-                            "content": text,
+                "type": "column_list",
+                "column_list": {
+                    "children": [
+                        {
+                            "object": "block",
+                            "type": "column",
+                            "column": {"children": [ext_img_block(gd.igdb_images[-1])]}
                         },
-                    }],
-                    "icon": {
-                        "emoji": emoji
-                    },
-                    "color": color
+                        {
+                            "object": "block",
+                            "type": "column",
+                            "column": {"children": [text_block(" ")]}
+                        },
+                    ]
                 }
-            }
+            })
 
-        def ext_img_block(url):
-            return {
-                "object": "block",
-                "type": "image",
-                "image": {
-                    "type": "external",
-                    "external": {
-                        "url": url
-                    }
-                }
-            }
-        if game['properties']['Data Fetched']['select']['name'] == LOAD_ALL_OPTION:
-            req_children = requests.get(
-                f"{NOTION_BASE_URL}/blocks/{game['id']}/children?page_size=100", 
-                headers=notion_headers)
-        
-            if len(req_children.json()["results"]) <= 5:
+    if gd.grid_credits_icon is not None:
+        page_children.append(text_block(f"Icon Credit: {gd.grid_credits_icon} on SteamGrid"))
+    if gd.grid_credits_front is not None:
+        page_children.append(text_block(f"Grid Credit: {gd.grid_credits_front} on SteamGrid"))
+    if gd.grid_credits_hero is not None:
+        page_children.append(text_block(f"Hero Credit: {gd.grid_credits_hero} on SteamGrid"))
 
-                if gd.release_date is not None:
-                    page_children.append(text_block(f"Release Date: {gd.release_date}"))
+    if len(page_children) == 0:
+        return
 
-                if gd.wikipedia_link is not None:
-                    page_children.append(link_block("Wikipedia", gd.wikipedia_link))
+    with metrics.span("write_body", gd.timings):
+        # Continues the partial body an earlier attempt left behind, if any
+        appended_blocks = (dead_letters.get(game['id']) or {}).get('appended_blocks', 0)
+        blocks.append_children(NOTION_BASE_URL, game['id'], page_children, start=appended_blocks)
+
+
+class PageWorkerPool:
+    """
+    Processes the pages returned by a poll concurrently on a fixed number of workers, shared by all databases.
+    The workers take turns between the databases, so a huge backfill of one database does not starve the others.
+    Pages that are still being processed are ignored when a later poll returns them again.
+    Every page is processed in isolation - a failing page is marked as "Failed" and recorded in the dead letters
+    for a later retry, without affecting the other pages.
+    """
+
+    def __init__(self, workers=PAGE_WORKERS, max_pending=MAX_PENDING_BATCHES):
+        self._scheduler = FairScheduler(workers)
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, database, pages):
+        """
+        Processes the pages in the background - but waits first while `max_pending` batches are not done yet.
+        """
+        fresh = self.__claim(pages)
+        if len(fresh) > 0:
+            self._pending.acquire()
+            threading.Thread(target=self.__run_pending, args=(database, fresh), daemon=True).start()
+        return len(fresh)
+
+    def process(self, database, pages):
+        """
+        Like submit, but waits for the pages. Returns the ids of the pages that were updated.
+        """
+        fresh = self.__claim(pages)
+        if len(fresh) == 0:
+            return set()
+        return self.__run_batch(database, fresh)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def __claim(self, pages):
+        with self._lock:
+            fresh = [page for page in pages if page['id'] not in self._in_flight]
+            self._in_flight.update(page['id'] for page in fresh)
+        return fresh
+
+    def __run_pending(self, database, pages):
+        try:
+            self.__run_batch(database, pages)
+        finally:
+            self._pending.release()
+
+    def __run_batch(self, database, pages):
+        # Resolve the names first, so the IGDB and SteamGrid lookups of the whole batch can be batched
+        igdb_resolver = igdb.BatchResolver()
+        steamgrid_batch = steamgrid.ImageBatch()
+        try:
+            identified = self._scheduler.map(database.id, lambda game: (game, self.__isolated(
+                database, game, identify_page, database, game, igdb_resolver, steamgrid_batch)), pages)
+            queued = [(game, gd) for game, gd in identified if gd is not None]
+
+            # Pages that keep their body only need IGDB if one of the properties does
+            needs_meta_data = [gd for game, gd in queued if page_option(game) != LOAD_IMAGES_OPTION
+                               and schema.IGDB in database.schema.sources(page_body=not gd.has_body)]
+            if not providers.enabled("igdb"):
+                needs_meta_data = []
+            try:
+                by_id = [gd for gd in needs_meta_data if 'igdb' in gd.identity]
+                by_name = [gd for gd in needs_meta_data if 'igdb' not in gd.identity]
+                with metrics.span("igdb_prefetch"):
+                    igdb_resolver.prefetch_ids([gd.identity['igdb'] for gd in by_id],
+                                               [gd.identity['igdb'] for gd in by_id if gd.refresh])
+                    igdb_resolver.prefetch([gd.name for gd in by_name], [gd.name for gd in by_name if gd.refresh])
+            except Exception:
+                logger.exception("Prefetching IGDB data failed, falling back to single lookups")
+
+            # Steam games only need their icon from SteamGrid - unless the Steam icon is preferred anyway
+            if not database.prio_original_steam_icons and providers.enabled("steamgrid"):
+                steam_games = [gd for game, gd in queued if gd.steamid is not None]
+                try:
+                    with metrics.span("steamgrid_prefetch"):
+                        steamgrid_batch.prefetch("icons", [gd.steamid for gd in steam_games], {},
+                                                 [gd.steamid for gd in steam_games if gd.refresh])
+                except Exception:
+                    logger.exception("Prefetching SteamGrid icons failed, falling back to single lookups")
+
+            updated = self._scheduler.map(
+                database.id, lambda item: self.__isolated(database, item[0], self.__update, database, *item), queued)
+            return {game['id'] for (game, gd), ok in zip(queued, updated) if ok}
+        finally:
+            with self._lock:
+                self._in_flight.difference_update(page['id'] for page in pages)
 
-                if gd.igdb_description is not None:
-                    page_children.append(text_block(gd.igdb_description))
+    @staticmethod
+    def __update(database, game, gd):
+        with metrics.span("page", gd.timings):
+            update_page(database, game, gd)
+        dead_letters.resolve(game['id'])
+        identities.update(game['id'], gd.match_key, gd.identity)
+
+        metrics.pages_processed.inc(result="updated", database=database.name)
+        logger.info("Processed page %s", game['id'], extra={'page_id': game['id'], 'database': database.name,
+                                                            'option': page_option(game), 'game': gd.name,
+                                                            'steamid': gd.steamid, 'timings': gd.timings})
+        return True
 
-                if gd.time_to_beat_weblink is not None:
+    @staticmethod
+    def __isolated(database, game, func, *args):
+        """
+        Runs one step of a page, recording any failure instead of letting it escape to the other pages.
+        """
+        try:
+            return func(*args)
+        except Exception as e:
+            metrics.pages_processed.inc(result="failed", database=database.name)
+            logger.exception("Processing page %s failed", game['id'], extra={'page_id': game['id'],
+                                                                            'database': database.name,
+                                                                            'option': page_option(game)})
+            entry = dead_letters.record(game['id'], page_option(game), f"{type(e).__name__}: {e}",
+                                        permanent=isinstance(e, PageFailure) and e.permanent,
+                                        appended_blocks=e.appended if isinstance(e, blocks.PartialAppend) else None)
+            try:
+                fail_notion(game['id'])
+            except requests.RequestException:
+                logger.exception("Marking page %s as failed did not work either", game['id'])
+            if entry['next_attempt'] is None:
+                logger.warning("Giving up on page %s after %s attempts", game['id'], entry['attempts'])
+            return None
 
-                    page_children.append(text_block(" "))
-                    page_children.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [
-                                {
-                                    "type": "text",
-                                    "text": {
-                                        "content": "How Long To Beat Data:",
-                                        "link": {"url": gd.time_to_beat_weblink}
-                                    },
-                                    "annotations": {
-                                        "bold": False,
-                                        "italic": False,
-                                        "strikethrough": False,
-                                        "underline": True,
-                                        "code": False,
-                                        "color": "default"
-                                    },
-                                }
-                            ]
-                        }
-                    })
 
-                    page_children.append({
-                        "object": "block",
-                        "type": "column_list",
-                        "column_list": {
-                            "children": [
-                                {
-                                    "object": "block",
-                                    "type": "column",
-                                    "column": {"children": [
-                                        callout_block(f"Normal: {gd.time_to_beat_main}", "🏁", "yellow_background")
-                                    ]}
-                                },
-                                {
-                                    "object": "block",
-                                    "type": "column",
-                                    "column": {"children": [
-                                        callout_block(f"Main+Extra: {gd.time_to_beat_extra}", "📌", "yellow_background")
-                                    ]}
-                                },
-                                {
-                                    "object": "block",
-                                    "type": "column",
-                                    "column": {"children": [
-                                        callout_block(f" Completion: {gd.time_to_beat_completionist}", "✅", "yellow_background")
-                                    ]}
-                                },
-                            ]
-                        }
-                    })
+page_pool = PageWorkerPool()
 
-                if gd.yt_trailer is not None:
-                    page_children.append(text_block(" "))
-                    page_children.append({
-                        "object": "block",
-                        "type": "video",
-                        "video": {
-                        "type": "external",
-                        "external": {
-                            "url": gd.yt_trailer
-                        }
-                        }
-                    })
+metrics.register(metrics.Gauge("pages_in_flight", "Pages queued or being processed.", page_pool.in_flight))
+metrics.register(metrics.Gauge("dead_letters", "Failed pages waiting for a retry or given up on.",
+                               lambda: len(dead_letters.entries())))
 
-                if gd.igdb_images is not None:
 
-                    # the spacing of two separate columns looks off, so we are using rows of columns instead
+class GameData:
 
-                    for i in range(1, len(gd.igdb_images), 2):
-                        page_children.append({
-                            "object": "block",
-                            "type": "column_list",
-                            "column_list": {
-                                "children": [
-                                    {
-                                        "object": "block",
-                                        "type": "column",
-                                        "column": {"children": [ext_img_block(gd.igdb_images[i - 1])]}
-                                    },
-                                    {
-                                        "object": "block",
-                                        "type": "column",
-                                        "column": {"children": [ext_img_block(gd.igdb_images[i])]}
-                                    },
-                                ]
-                            }
-                        })
-
-                    if len(gd.igdb_images) % 2 != 0:
-                        page_children.append({
-                            "object": "block",
-                            "type": "column_list",
-                            "column_list": {
-                                "children": [
-                                    {
-                                        "object": "block",
-                                        "type": "column",
-                                        "column": {"children": [ext_img_block(gd.igdb_images[-1])]}
-                                    },
-                                    {
-                                        "object": "block",
-                                        "type": "column",
-                                        "column": {"children": [text_block(" ")]}
-                                    },
-                                ]
-                            }
-                        })
-
-                if gd.grid_credits_icon is not None:
-                    page_children.append(text_block(f"Icon Credit: {gd.grid_credits_icon} on SteamGrid"))
-                if gd.grid_credits_front is not None:
-                    page_children.append(text_block(f"Grid Credit: {gd.grid_credits_front} on SteamGrid"))
-                if gd.grid_credits_hero is not None:
-                    page_children.append(text_block(f"Hero Credit: {gd.grid_credits_hero} on SteamGrid"))
-
-                if len(page_children) == 0:
-                    return
-
-                r_page_content = requests.patch(
-                    f"{NOTION_BASE_URL}/blocks/{game['id']}/children",
-                    headers=notion_headers,
-                    data=json.dumps({
-                        'children': page_children
-                    })
-                )
+    def __init__(self, igdb_resolver=None, steamgrid_batch=None, refresh=False, identity=None,
+                 prio_original_steam_icons=databases.PRIO_ORIGINAL_STEAM_ICONS):
 
+        # Ignore (but still update) cached lookups
+        self.refresh = refresh
+        self.prio_original_steam_icons = prio_original_steam_icons
 
-class GameData:
+        self.name = None
+        self.steamid = None
 
-    def __init__(self):
+        # Ids of the IGDB, SteamGrid and HLTB matches, reused instead of searching again - filled in as they are found
+        self.identity = dict(identity or {})
+        self.match_key = None
 
-        self.name = None
-        self.steamgrid_id = None
+        # Whether the page already has a body, which is kept - checked while identifying the page
+        self.has_body = False
+
+        self.steamgrid_id = self.identity.get('steamgrid')
+        self.igdb_resolver = igdb_resolver if igdb_resolver is not None else igdb.BatchResolver()
+        self.steamgrid_batch = steamgrid_batch if steamgrid_batch is not None else steamgrid.ImageBatch()
 
         # Image Data (Steam or SteamGrid)
         self.icon = None
@@ -464,6 +969,11 @@ class GameData:
         # Youtube Trailer link
         self.yt_trailer = None
         self.yt_trailer_video_id = None
+        self.__yt_lock = threading.Lock()
+        self.__yt_fetched = False
+
+        # Seconds spent per stage, for the log line of the page
+        self.timings = {}
 
         # HLTB
         self.time_to_beat_weblink = None
@@ -477,183 +987,316 @@ class GameData:
         floor = math.floor(htlb)
         return str(floor) + "h " + str(math.floor((htlb - floor) * 60)) + "m"
 
-    def fetch_data_by_steamid(self, steamid):
-
-        r = requests.get(f"http://store.steampowered.com/api/appdetails?appids={steamid}")
-        if r.status_code != 200 or not r.json()[str(steamid)]['success']:
-            return False # TODO Handle error outside - update notion to "failed" status
-
-        data = r.json()[str(steamid)]['data']
+    def identify_by_steamid(self, steamid):
+        """
+        Identifies a Steam game - only resolves the name (and the images Steam gives us for free), so the
+        IGDB lookups of all games in a cycle can be batched before the remaining data is fetched.
+        """
+        data = self.__steam_app_details(steamid)
+        if data is None:
+            return False
 
+        self.steamid = steamid
         self.name = cleanup_name(data['name'])
         self.front = data['header_image']
         self.hero = f"https://steamcdn-a.akamaihd.net/steam/apps/{steamid}/library_hero.jpg"
+        return True
 
-        if PRIO_ORIGINAL_STEAM_ICONS:
-            r_icon = requests.get(f"https://steamicons.adriansteffan.com/{steamid}")
-            if r_icon.status_code == 200:
-                self.icon = r_icon.content.decode("utf-8")
-            else:
-                self.icon, self.grid_credits_icon = self.request_image_by_name("icons", {})
-        else:
-            self.icon, self.grid_credits_icon = self.request_image_by_name("icons", {})
-            if self.icon is None:
-                r_icon = requests.get(f"https://steamicons.adriansteffan.com/{steamid}")
-                if r_icon.status_code == 200:
-                    self.icon = r_icon.content.decode("utf-8")
-
-        self.__fetch_meta_data()
+    def __steam_app_details(self, steamid):
+        def fetch():
+            r = http_client.steam().get(f"{STEAM_STORE_URL}/appdetails?appids={steamid}")
+            if r.status_code != 200 or not r.json()[str(steamid)]['success']:
+                return None
+            return r.json()[str(steamid)]['data']
 
-        return True
+        return cache.get_or_fetch("steam", steamid, fetch, self.refresh)
 
-    def fetch_data_by_name(self, name):
+    def identify_by_name(self, name):
+        """
+        Routes the name through the cheaper Steam path if the offline Steam catalog knows it.
+        The name itself is kept, so the page title stays unaffected.
+        """
         self.name = name
 
-        self.icon, self.grid_credits_icon = self.request_image_by_name("icons", {})
-        self.front, self.grid_credits_front = self.request_image_by_name("grids", {'dimensions': ['460x215', '920x430']})
-        self.hero, self.grid_credits_hero = self.request_image_by_name("heroes", {'dimensions': ["1920x620"]})
-
-        self.__fetch_meta_data()
+        steamid = steam_catalog.lookup(name)
+        if steamid is not None:
+            data = self.__steam_app_details(steamid)
+            # The app list also contains soundtracks, DLC, tools, ... - only use actual games
+            if data is not None and data.get('type') == 'game':
+                self.identify_by_steamid(steamid)
+                self.name = name
+
+    def fetch_remaining_data(self, sources=schema.SOURCES):
+        """
+        Runs the fetches of the enabled providers of the given sources concurrently - the sources the database has
+        no use for are skipped entirely. The only ordering constraints between them are:
+          * the SteamGrid id has to be known before icons, grids and heroes can be requested
+          * the YouTube video id is shared between the grid fallback and the trailer, whoever asks first fetches it
+        HLTB and IGDB are independent of everything else.
+        """
+        with ThreadPoolExecutor(max_workers=FANOUT_WORKERS) as pool:
+            tasks = [pool.submit(self.__timed, source, fetch, self, pool)
+                     for source, fetch in providers.fetches(sources)]
+            for task in tasks:
+                task.result()
+
+    def fetch_images(self):
+        """
+        Only fetches icon, grid and hero - everything "Load Images" needs.
+        """
+        with ThreadPoolExecutor(max_workers=FANOUT_WORKERS) as pool:
+            for source, fetch in providers.fetches({schema.IMAGES}):
+                self.__timed(source, fetch, self, pool)
+
+    def __timed(self, stage, fetch, *args):
+        with metrics.span(stage, self.timings):
+            fetch(*args)
+
+    def fill_images(self, pool):
+        if self.steamid is not None:
+            if self.prio_original_steam_icons:
+                self.icon = self.fetch_steam_icon()
+                if self.icon is None:
+                    self.icon, self.grid_credits_icon = self.request_image_by_name("icons", {})
+            else:
+                self.icon, self.grid_credits_icon = self.request_image_by_name("icons", {})
+                if self.icon is None:
+                    self.icon = self.fetch_steam_icon()
+            return
+
+        if not self.fetch_steamgrid_id():
+            return
+
+        icon = pool.submit(self.request_image_by_name, "icons", {})
+        front = pool.submit(self.request_image_by_name, "grids", {'dimensions': ['460x215', '920x430']})
+        hero = pool.submit(self.request_image_by_name, "heroes", {'dimensions': ["1920x620"]})
+
+        self.icon, self.grid_credits_icon = icon.result()
+        self.front, self.grid_credits_front = front.result()
+        self.hero, self.grid_credits_hero = hero.result()
+
+    def fetch_yt_trailer_video_id(self):
+        with self.__yt_lock:
+            if not self.__yt_fetched:
+                self.yt_trailer_video_id = youtube.search_service.trailer_id(
+                    self.name, self.refresh, api=providers.enabled("youtube_api"),
+                    scrape=providers.enabled("youtube_scrape"))
+                self.__yt_fetched = True
+            return self.yt_trailer_video_id
 
     def fetch_steamgrid_id(self):
-        r = requests.get(f'{GRID_BASE_URL}/search/autocomplete/{self.name}',
-                         headers=steamgrid_headers)
-
-        if r.status_code != 200 or not r.json()['success'] or len(r.json()['data']) == 0:
+        if not providers.enabled("steamgrid"):
             return False
+        if self.steamgrid_id is None:
+            self.steamgrid_id = steamgrid.search_id(self.name, self.refresh)
+            self.identity['steamgrid'] = self.steamgrid_id
+        return self.steamgrid_id is not None
 
-        self.steamgrid_id = r.json()['data'][0]['id']
-        return True
-    
-    def request_image_by_name(self, image_type, params):
-        if not self.steamgrid_id:
-            if not self.fetch_steamgrid_id():
-                return None, None
-
-        r = requests.get(f'{GRID_BASE_URL}/{image_type}/game/{self.steamgrid_id}',
-                         params=params,
-                         headers=steamgrid_headers)
-        if r.status_code != 200 or not r.json()['success'] or len(r.json()['data']) == 0:
-
-            if image_type != 'grids':
-                return None, None
-
-            # If no other grid was found, use the yt trailer thumbnail
-            self.yt_trailer_video_id = get_yt_id_by_name(self.name)
-            if self.yt_trailer_video_id:
-                return f"https://i.ytimg.com/vi/{self.yt_trailer_video_id}/maxresdefault.jpg", None
-            else:
-                return None, None
+    def fetch_steam_icon(self):
+        if not providers.enabled("steamicons"):
+            return None
 
-        data = r.json()['data']
+        def fetch():
+            r_icon = http_client.steamicons().get(f"{STEAM_ICONS_URL}/{self.steamid}")
+            if r_icon.status_code != 200:
+                return None
+            return r_icon.content.decode("utf-8")
 
-        # edge case to prefer higher res icons over the first ones
-        if image_type == 'icons':
-            icons_filtered = list(filter(lambda icon: icon['width'] >= 64, data))
-            item = data[0] if len(icons_filtered) == 0 else icons_filtered[0]
+        return cache.get_or_fetch("steamicons", self.steamid, fetch, self.refresh)
+
+    def request_image_by_name(self, image_type, params):
+        if not providers.enabled("steamgrid"):
+            image = None
+        elif self.steamid is not None:
+            # SteamGrid knows Steam games by their appid, no need to search for the name
+            image = self.steamgrid_batch.image_by_steam_appid(image_type, self.steamid, params, self.refresh)
         else:
-            item = data[0]
+            if not self.steamgrid_id:
+                if not self.fetch_steamgrid_id():
+                    return None, None
+            image = steamgrid.image_by_game_id(image_type, self.steamgrid_id, params, self.refresh)
 
-        return item['url'], item['author']['name']
+        if image is not None:
+            return image[0], image[1]
 
-    def __fetch_meta_data(self):
+        if image_type != 'grids':
+            return None, None
 
-        # HLTB
-        results = HowLongToBeat().search(self.name)
+        # If no other grid was found, use the yt trailer thumbnail
+        if self.fetch_yt_trailer_video_id():
+            return f"https://i.ytimg.com/vi/{self.yt_trailer_video_id}/maxresdefault.jpg", None
+        else:
+            return None, None
 
-        if not results:
-            results = HowLongToBeat().search(strip_non_ascii(self.name))
+    def fill_hltb(self, pool=None):
+        try:
+            hltb_data = hltb.resolve(self.name, self.refresh, self.identity.get('hltb'))
+        except Exception:
+            # HLTB is scraped and breaks now and then - the page is still written, just without the times
+            logger.warning("Looking up %s on HLTB failed", self.name, exc_info=True)
+            return
+
+        if hltb_data is not None:
+            self.identity['hltb'] = {'id': hltb_data['id'], 'name': hltb_data['name']}
+            self.time_to_beat_weblink = hltb_data['web_link']
+            self.time_to_beat_main = GameData.__hltb_to_string(hltb_data['main_story'])
+            self.time_to_beat_extra = GameData.__hltb_to_string(hltb_data['main_extra'])
+            self.time_to_beat_completionist = GameData.__hltb_to_string(hltb_data['completionist'])
+            self.time_to_beat_all_styles = hltb_data['all_styles']
+
+    def fill_igdb(self, pool=None):
+        igdb_game = None
+        if 'igdb' in self.identity:
+            igdb_game = self.igdb_resolver.resolve_id(self.identity['igdb'], self.refresh)
+        if igdb_game is None:
+            igdb_game = self.igdb_resolver.resolve(self.name, self.refresh)
+
+        if igdb_game is not None:
+            self.identity['igdb'] = igdb_game['id']
+            # Plain Meta Data
+            if 'first_release_date' in igdb_game.keys():
+                self.release_date = datetime.utcfromtimestamp(int(igdb_game['first_release_date'])).strftime('%d %b %Y')
+                self.release_date_iso = datetime.utcfromtimestamp(int(igdb_game['first_release_date'])).strftime('%Y-%m-%d')
+            if 'summary' in igdb_game.keys():
+                self.igdb_description = igdb_game['summary']
+            if 'genres' in igdb_game.keys():
+                self.genres = igdb_game["genres"]
+            if 'themes' in igdb_game.keys():
+                self.themes = igdb_game["themes"]
+            if 'involved_companies' in igdb_game.keys():
+                self.developers = list(filter(lambda d: d["developer"] is True, igdb_game["involved_companies"]))
+                self.publishers = list(filter(lambda p: p["developer"] is False and p["publisher"] is True, igdb_game["involved_companies"]))
+            if 'rating' in igdb_game.keys():
+                self.igdb_rating = igdb_game["rating"]
+            if 'aggregated_rating' in igdb_game.keys():
+                if self.igdb_rating is not None:
+                    self.igdb_rating = (self.igdb_rating + igdb_game["aggregated_rating"]) /2
+                else:
+                    self.igdb_rating = igdb_game["aggregated_rating"]
 
-        if not results:
-            results = HowLongToBeat().search(self.name.lower().title())
+            # Wikipedia Link
+            if 'websites' in igdb_game.keys():
+                try:
+                    self.wikipedia_link = next(w['url'] for w in igdb_game['websites'] if w['category'] == 3)
+                except StopIteration:
+                    pass
 
-        if not results:
-            results = HowLongToBeat().search(strip_non_ascii(self.name).lower().title())
+            # Screenshots
+            if 'screenshots' in igdb_game.keys():
+                self.igdb_images = [f"https:{s['url'].replace('t_thumb', SCREENSHOT_SIZE)}" for s in igdb_game['screenshots']]
 
-        if results:
-            hltb = max(results, key=lambda element: element.similarity)
+    def fill_trailer(self, pool=None):
+        if self.fetch_yt_trailer_video_id():
+            self.yt_trailer = f"https://www.youtube.com/watch?v={self.yt_trailer_video_id}"
 
-            self.time_to_beat_weblink = hltb.game_web_link
-            self.time_to_beat_main = GameData.__hltb_to_string(hltb.main_story)
-            self.time_to_beat_extra = GameData.__hltb_to_string(hltb.main_extra)
-            self.time_to_beat_completionist = GameData.__hltb_to_string(hltb.completionist)
-            self.time_to_beat_all_styles = hltb.all_styles 
 
-        # IGDB Data
-        r_creds = requests.post(
-            f"https://id.twitch.tv/oauth2/token?client_id={config.IGDB_CLIENT_ID}&client_secret={config.IGDB_SECRET}&grant_type=client_credentials")
+providers.register(providers.Provider(
+    "steam", None, ("name", "steamid", "front", "hero"), cost=1, optional=False))
+providers.register(providers.Provider(
+    "steamgrid", schema.IMAGES,
+    ("icon", "front", "hero", "grid_credits_icon", "grid_credits_front", "grid_credits_hero"),
+    cost=4, fetch=GameData.fill_images))
+providers.register(providers.Provider(
+    "steamicons", schema.IMAGES, ("icon",), cost=1, fetch=GameData.fill_images))
+providers.register(providers.Provider(
+    "igdb", schema.IGDB,
+    ("release_date", "release_date_iso", "wikipedia_link", "igdb_description", "igdb_rating", "igdb_images",
+     "genres", "themes", "developers", "publishers"),
+    cost=1, fetch=GameData.fill_igdb))
+providers.register(providers.Provider(
+    "hltb", schema.HLTB,
+    ("time_to_beat_weblink", "time_to_beat_main", "time_to_beat_extra", "time_to_beat_completionist",
+     "time_to_beat_all_styles"),
+    cost=4, fetch=GameData.fill_hltb, modules=("howlongtobeatpy",)))
+providers.register(providers.Provider(
+    "youtube_api", schema.TRAILER, ("yt_trailer", "yt_trailer_video_id"), cost=1, fetch=GameData.fill_trailer,
+    modules=("googleapiclient", "httplib2"), configured=lambda: youtube.search_service.api_key != ""))
+providers.register(providers.Provider(
+    "youtube_scrape", schema.TRAILER, ("yt_trailer", "yt_trailer_video_id"), cost=1, fetch=GameData.fill_trailer,
+    modules=("youtube_search",)))
 
 
-        if r_creds.status_code == 200:
+def print_providers():
+    for provider in providers.providers():
+        state = "enabled" if provider.enabled() else "not installed" if not provider.installed() else "disabled"
+        print(f"{provider.name:<16}{provider.source or 'identify':<10}{state:<15}~{provider.cost} requests/game  "
+              f"{', '.join(provider.fields)}")
 
-            igdb_token = r_creds.json()['access_token']
 
-            r = requests.post(f'{IGDB_BASE_URL}/games',
-                              data=f'fields *, genres.name, themes.name, involved_companies.company.name, involved_companies.developer, involved_companies.publisher;search "{self.name}";'.encode('utf-8'),
-                              headers=igdb_headers(igdb_token))
+def fetch_page(page_id):
+    r = http_client.notion().get(f"{NOTION_BASE_URL}/pages/{page_id}")
+    r.raise_for_status()
+    return r.json()
 
-            if r.status_code == 200 and len(r.json()) > 0:
-                data = r.json()
-                try:
-                    igdb_game = data[next(i for i, v in enumerate(data) if v['name'].lower() == self.name.lower())]
-                except StopIteration:
-                    igdb_game = data[0]
-                game_id = igdb_game['id']
-
-                # Plain Meta Data
-                if 'first_release_date' in igdb_game.keys():
-                    self.release_date = datetime.utcfromtimestamp(int(igdb_game['first_release_date'])).strftime('%d %b %Y')
-                    self.release_date_iso = datetime.utcfromtimestamp(int(igdb_game['first_release_date'])).strftime('%Y-%m-%d')
-                if 'summary' in igdb_game.keys():
-                    self.igdb_description = igdb_game['summary']
-                if 'genres' in igdb_game.keys():
-                    self.genres = igdb_game["genres"]
-                if 'themes' in igdb_game.keys():
-                    self.themes = igdb_game["themes"]
-                if 'involved_companies' in igdb_game.keys():
-                    self.developers = list(filter(lambda d: d["developer"] is True, igdb_game["involved_companies"]))
-                    self.publishers = list(filter(lambda p: p["developer"] is False and p["publisher"] is True, igdb_game["involved_companies"]))
-                if 'rating' in igdb_game.keys():
-                    self.igdb_rating = igdb_game["rating"]
-                if 'aggregated_rating' in igdb_game.keys():
-                    if self.igdb_rating is not None:
-                        self.igdb_rating = (self.igdb_rating + igdb_game["aggregated_rating"]) /2
-                    else:
-                        self.igdb_rating = igdb_game["aggregated_rating"]
-
-                # Wikipedia Link
-                r_website = requests.post(f'{IGDB_BASE_URL}/websites',
-                                          data=f'fields *; where game = {game_id};',
-                                          headers=igdb_headers(igdb_token))
-
-                if r_website.status_code == 200 and len(r_website.json()) > 0:
-                    w_data = r_website.json()
-                    try:
-                        self.wikipedia_link = w_data[next(i for i, v in enumerate(w_data) if v['category'] == 3)]['url']
-                    except StopIteration:
-                        pass
-
-                # Screenshots
-                r_screen = requests.post(f'{IGDB_BASE_URL}/screenshots',
-                                         data=f'fields *; where game = {game_id};',
-                                         headers=igdb_headers(igdb_token))
-
-                if r_screen.status_code == 200:
-                    self.igdb_images = [f"https:{s['url'].replace('t_thumb', 't_original')}" for s in r_screen.json()]
 
-        # Youtube Trailer link
-        if not self.yt_trailer_video_id:
-            self.yt_trailer_video_id = get_yt_id_by_name(self.name)
-        if self.yt_trailer_video_id:
-            self.yt_trailer = f"https://www.youtube.com/watch?v={self.yt_trailer_video_id}"
+def fetch_database(database_id):
+    r = http_client.notion().get(f"{NOTION_BASE_URL}/databases/{database_id}")
+    r.raise_for_status()
+    return r.json()
+
+
+served_databases = databases.Databases(fetch_database)
 
 
 if __name__ == "__main__":
-    # Not the cleanest solution, but works for the simple purpose of this tool.
-    # Delaying for x seconds after execution instead of executing every x seconds is actually the intended behavior in
-    # order to avoid collisions if the Notion API takes longer x seconds to respond.
-    while True:
-        check_and_update_notion()
-        time.sleep(3)
+    parser = argparse.ArgumentParser(description="Loads video game data into a Notion database.")
+    parser.add_argument("--json-logs", action="store_true", help="log one JSON object per line")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve Prometheus metrics on this port (in serve mode, they are also on /metrics)")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("poll", help="poll the database for pages to update (default)")
+    serve_parser = subparsers.add_parser("serve", help="update pages on trigger events, polling only as a fallback")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    backfill_parser = subparsers.add_parser("backfill", help="update every page of the databases (or a subset) once")
+    backfill_filter = backfill_parser.add_mutually_exclusive_group()
+    backfill_filter.add_argument("--missing", metavar="PROPERTY", help="only pages where this property is empty")
+    backfill_filter.add_argument("--filter", help="only pages matching this Notion database filter (JSON)")
+    backfill_parser.add_argument("--option", default=LOAD_ALL_OPTION,
+                                 choices=[LOAD_ALL_OPTION, LOAD_IMAGES_OPTION, REFRESH_ALL_OPTION],
+                                 help="process the pages as if \"Data Fetched\" was set to this")
+    backfill_parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of a previous run")
+    backfill_parser.add_argument("--database", action="append", metavar="ID_OR_NAME",
+                                 help="only backfill this database (repeatable, default: every configured database)")
+    subparsers.add_parser("providers", help="list the data sources and whether they are enabled")
+    forget_parser = subparsers.add_parser("forget", help="forget the matched games of pages, e.g. after a wrong match")
+    forget_parser.add_argument("page_ids", nargs="+", metavar="page_id")
+    forget_parser.add_argument("--source", action="append", choices=identity_store.SOURCES,
+                               help="only forget the match of this source (repeatable, default: all)")
+    pin_parser = subparsers.add_parser("pin", help="match a page with the given ids, e.g. after a wrong match")
+    pin_parser.add_argument("page_id")
+    pin_parser.add_argument("--igdb", type=int, metavar="ID", help="the id of the game on IGDB")
+    pin_parser.add_argument("--steamgrid", type=int, metavar="ID", help="the id of the game on SteamGridDB")
+    pin_parser.add_argument("--hltb", type=int, metavar="ID", help="the id of the game on HowLongToBeat")
+    args = parser.parse_args()
+
+    metrics.setup_logging(logging.INFO, args.json_logs)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_host, args.metrics_port)
+
+    # server and backfill import this module as "main" - make sure they get this instance instead of a second copy
+    sys.modules.setdefault("main", sys.modules[__name__])
+
+    if args.command == "serve":
+        import server
+        server.serve(args.host, args.port)
+    elif args.command == "backfill":
+        import backfill
+        backfill.run_all(backfill.select_databases(args.database), args)
+    elif args.command == "providers":
+        print_providers()
+    elif args.command == "forget":
+        for page_id in args.page_ids:
+            forget_matches(page_id, args.source or identity_store.SOURCES)
+    elif args.command == "pin":
+        pins = {'igdb': args.igdb, 'steamgrid': args.steamgrid,
+                'hltb': None if args.hltb is None else {'id': args.hltb, 'name': None}}
+        pins = {source: value for source, value in pins.items() if value is not None}
+        if len(pins) == 0:
+            parser.error("pin needs at least one of --igdb, --steamgrid and --hltb")
+        pin_matches(args.page_id, pins)
+    else:
+        Poller().run()
 
 
@@ -0,0 +1,204 @@
+"""
+Counters and timings of the hot paths, exposed in the Prometheus text format.
+
+    python main.py --metrics-port 9100           GET http://127.0.0.1:9100/metrics
+    python main.py serve                         GET /metrics next to /trigger
+
+With --json-logs every log line is a JSON object, including one "page processed" line per page with the time
+spent in each stage.
+"""
+import bisect
+import contextlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PREFIX = "gallery_"
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, documentation):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self._values.items())]
+        return lines
+
+
+class Gauge:
+    """
+    A value read from `read()` whenever the metrics are rendered, e.g. the length of a queue.
+    """
+
+    def __init__(self, name, documentation, read):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets=BUCKETS):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, seconds, **labels):
+        key = _labels_key(labels)
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts, count, total = self._values.get(key, ([0] * len(self.buckets), 0, 0.0))
+            if i < len(self.buckets):
+                counts[i] += 1
+            self._values[key] = (counts, count + 1, total + seconds)
+
+    def totals(self):
+        """
+        Returns {labels: (count, sum)}, labels as a tuple of (name, value) pairs.
+        """
+        with self._lock:
+            return {key: (count, total) for key, (_, count, total) in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, count, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+        return lines
+
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+upstream_requests = register(Counter("upstream_requests_total", "Calls to an upstream, by whether they raised."))
+upstream_responses = register(Counter("upstream_responses_total", "HTTP responses of upstreams, by status code."))
+upstream_retries = register(Counter("upstream_retries_total", "Retried upstream requests, by the reason to retry."))
+upstream_seconds = register(Histogram("upstream_request_seconds", "Time spent in upstream calls."))
+cache_lookups = register(Counter("cache_lookups_total", "Cache lookups per source, by whether they were hits."))
+stage_seconds = register(Histogram("stage_seconds", "Time spent in the stages of processing a page."))
+pages_processed = register(Counter("pages_total", "Processed pages, by result."))
+
+
+@contextlib.contextmanager
+def span(stage, timings=None):
+    """
+    Times the block as `stage`, and also adds the duration to the `timings` dict if given.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - started
+        stage_seconds.observe(seconds, stage=stage)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0) + seconds, 3)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') != "/metrics":
+            self.send_error(404)
+            return
+        respond_metrics(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def respond_metrics(handler):
+    data = render().encode('utf-8')
+    handler.send_response(200)
+    handler.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    handler.send_header('Content-Length', str(len(data)))
+    handler.end_headers()
+    handler.wfile.write(data)
+
+
+def serve(host, port):
+    """
+    Serves /metrics on a background thread.
+    """
+    httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the fields passed to the log call as `extra`.
+    """
+
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self._RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=logging.INFO, json_logs=False):
+    handler = logging.StreamHandler()
+    if json_logs:
+        handler.setFormatter(JsonFormatter())
+    logging.basicConfig(level=level, handlers=[handler])
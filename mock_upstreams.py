@@ -0,0 +1,374 @@
+"""
+Local stand-ins for every upstream the script talks to, replaying the recorded responses in fixtures/.
+Each upstream lives under its own path prefix of a single HTTP server, with its own latency, error rate and
+rate limit, and counts the requests it receives. Used by benchmark.py.
+"""
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+NOTION = "notion"
+TWITCH = "twitch"
+IGDB = "igdb"
+STEAMGRID = "steamgrid"
+STEAM = "steam"
+STEAMICONS = "steamicons"
+HLTB = "hltb"
+YOUTUBE = "youtube"
+
+UPSTREAMS = (NOTION, TWITCH, IGDB, STEAMGRID, STEAM, STEAMICONS, HLTB, YOUTUBE)
+
+LOAD_OPTIONS = ("Load All", "Load Images", "Refresh All")
+
+# Parent of the synthetic pages - the benchmark passes the id of the database it polls
+DATABASE_ID = "00000000-0000-4000-8000-000000000000"
+
+_IGDB_QUERY = re.compile(r'query games "(\d+)" \{[^}]*?search "((?:[^"\\]|\\.)*)"; \};')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class UpstreamBehavior:
+    """
+    How an upstream misbehaves: `latency` seconds per request (+- `jitter`), a share of `error_rate` requests
+    answered with a 500, and at most `rate_limit` requests per second before answering 429 with a Retry-After.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._window = 0
+        self._window_requests = 0
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def throttled(self):
+        if self.rate_limit is None:
+            return False
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window = window
+                self._window_requests = 0
+            self._window_requests += 1
+            return self._window_requests > self.rate_limit
+
+    def failed(self):
+        return random.random() < self.error_rate
+
+
+class MockUpstreams:
+    """
+    Serves a synthetic Notion database of `pages` (see synthetic_pages) and fixture-based answers for everything else.
+    """
+
+    def __init__(self, pages, behaviors=None, host="127.0.0.1", port=0, database=None):
+        self.behaviors = {upstream: UpstreamBehavior() for upstream in UPSTREAMS}
+        self.behaviors.update(behaviors or {})
+
+        self.database = database if database is not None else load_fixture("notion_database.json")
+
+        self.pages = {page['id']: page for page in pages}
+        self.page_order = [page['id'] for page in pages]
+        self.page_children = {}
+
+        self.steam_app = load_fixture("steam_appdetails.json")
+        self.igdb_game = load_fixture("igdb_game.json")
+        self.steamgrid_images = load_fixture("steamgrid_images.json")
+        self.hltb_entry = load_fixture("hltb_search.json")
+        self.youtube_search = load_fixture("youtube_search.json")
+
+        self._lock = threading.Lock()
+        self.requests = {upstream: 0 for upstream in UPSTREAMS}
+        self.responses = {upstream: {} for upstream in UPSTREAMS}
+        # First time a page was returned by a query and last time it was written, per page id
+        self.queued_at = {}
+        self.done_at = {}
+
+        mock = self
+
+        class Handler(_Handler):
+            upstreams = mock
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def base_url(self, upstream):
+        return f"{self.url}/{upstream}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, upstream, status):
+        with self._lock:
+            self.requests[upstream] += 1
+            self.responses[upstream][status] = self.responses[upstream].get(status, 0) + 1
+
+    # Notion
+
+    def query(self, body):
+        wanted = set(_select_values(body.get('filter')))
+        page_size = body.get('page_size', 100)
+        start = int(body.get('start_cursor') or 0)
+
+        with self._lock:
+            matching = [page_id for page_id in self.page_order
+                        if not wanted or _select(self.pages[page_id]) in wanted]
+            results = [copy.deepcopy(self.pages[page_id]) for page_id in matching[start:start + page_size]]
+            now = time.monotonic()
+            for page in results:
+                self.queued_at.setdefault(page['id'], now)
+
+        has_more = start + page_size < len(matching)
+        return {"object": "list", "results": results, "has_more": has_more,
+                "next_cursor": str(start + page_size) if has_more else None}
+
+    def get_page(self, page_id):
+        with self._lock:
+            page = self.pages.get(page_id)
+            return None if page is None else copy.deepcopy(page)
+
+    def patch_page(self, page_id, body):
+        with self._lock:
+            page = self.pages.get(page_id)
+            if page is None:
+                return None
+            for name, prop in body.get('properties', {}).items():
+                page['properties'][name] = prop
+            for key in ('icon', 'cover'):
+                if key in body:
+                    page[key] = body[key]
+            self.done_at[page_id] = time.monotonic()
+            return copy.deepcopy(page)
+
+    def children(self, page_id):
+        with self._lock:
+            return {"object": "list", "results": list(self.page_children.get(page_id, [])), "has_more": False}
+
+    def append_children(self, page_id, body):
+        with self._lock:
+            self.page_children.setdefault(page_id, []).extend(body.get('children', []))
+            self.done_at[page_id] = time.monotonic()
+            return {"object": "list", "results": body.get('children', [])}
+
+    # Everything else
+
+    def igdb_multiquery(self, query):
+        results = []
+        for index, name in _IGDB_QUERY.findall(query):
+            game = dict(self.igdb_game, id=_number(name), name=name.replace('\\"', '"').replace('\\\\', '\\'))
+            results.append({"name": index, "result": [game]})
+        return results
+
+    def igdb_games(self, query):
+        ids = re.search(r'where id = \(([\d,]+)\)', query)
+        if ids is None:
+            return []
+        return [dict(self.igdb_game, id=int(igdb_id)) for igdb_id in ids.group(1).split(',')]
+
+    def steamgrid_images_for(self, game_id):
+        return [dict(image, id=image['id'] + _number(game_id) % 100000) for image in self.steamgrid_images]
+
+    def steam_app_details(self, appid):
+        page = next((page for page in self.pages.values() if _steamid(page) == appid), None)
+        name = page['properties']['Name']['title'][0]['plain_text'] if page is not None else f"Steam App {appid}"
+        return {appid: {"success": True, "data": dict(self.steam_app, name=name, steam_appid=int(appid))}}
+
+    def hltb_search(self, body):
+        name = ' '.join(body.get('searchTerms', []))
+        entry = dict(self.hltb_entry, game_id=_number(name.lower()), game_name=name)
+        return {"color": "blue", "title": "", "category": "games", "count": 1, "pageCurrent": 1, "pageTotal": 1,
+                "pageSize": 20, "data": [entry]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    upstreams = None
+
+    # Send headers and body in one segment - otherwise delayed ACKs add ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__handle("GET")
+
+    def do_POST(self):
+        self.__handle("POST")
+
+    def do_PATCH(self):
+        self.__handle("PATCH")
+
+    def __handle(self, method):
+        url = urlsplit(self.path)
+        upstream, _, path = url.path.lstrip('/').partition('/')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+
+        if upstream not in self.upstreams.behaviors:
+            self.__reply(404, {"error": "unknown upstream"})
+            return
+
+        behavior = self.upstreams.behaviors[upstream]
+        time.sleep(behavior.delay())
+        if behavior.throttled():
+            self.upstreams.count(upstream, 429)
+            self.__reply(429, {"error": "rate limited"}, {"Retry-After": str(behavior.retry_after)})
+            return
+        if behavior.failed():
+            self.upstreams.count(upstream, 500)
+            self.__reply(500, {"error": "injected failure"})
+            return
+
+        status, response = self.__route(method, upstream, path, parse_qs(url.query), body)
+        self.upstreams.count(upstream, status)
+        self.__reply(status, response)
+
+    def __route(self, method, upstream, path, query, body):
+        mock = self.upstreams
+        parts = [unquote(part) for part in path.split('/')]
+
+        if upstream == NOTION:
+            # v1/databases/<id>/query, v1/pages/<id>, v1/blocks/<id>/children
+            if parts[1] == "databases" and method == "POST":
+                return 200, mock.query(json.loads(body or b'{}'))
+            if parts[1] == "databases":
+                return 200, mock.database
+            if parts[1] == "pages":
+                page = mock.get_page(parts[2]) if method == "GET" else mock.patch_page(parts[2], json.loads(body))
+                return (200, page) if page is not None else (404, {"object": "error", "code": "object_not_found"})
+            if parts[1] == "blocks" and method == "GET":
+                return 200, mock.children(parts[2])
+            if parts[1] == "blocks":
+                return 200, mock.append_children(parts[2], json.loads(body))
+
+        if upstream == TWITCH:
+            return 200, {"access_token": "benchmark", "expires_in": 5000000, "token_type": "bearer"}
+
+        if upstream == IGDB and parts[-1] == "multiquery":
+            return 200, mock.igdb_multiquery(body.decode('utf-8'))
+        if upstream == IGDB and parts[-1] == "games":
+            return 200, mock.igdb_games(body.decode('utf-8'))
+
+        if upstream == STEAMGRID:
+            # api/v2/search/autocomplete/<name>, api/v2/<type>/game/<id>, api/v2/<type>/steam/<id>[,<id>...]
+            if parts[2] == "search":
+                return 200, {"success": True, "data": [{"id": _number(parts[-1].lower()), "name": parts[-1]}]}
+            ids = parts[-1].split(',')
+            if len(ids) == 1:
+                return 200, {"success": True, "data": mock.steamgrid_images_for(ids[0])}
+            return 200, {"success": True, "data": [{"success": True, "status": 200, "data": mock.steamgrid_images_for(i)}
+                                                   for i in ids]}
+
+        if upstream == STEAM:
+            return 200, mock.steam_app_details(query['appids'][0])
+
+        if upstream == STEAMICONS:
+            return 200, f"https://steamicons.example/{parts[-1]}.ico"
+
+        if upstream == HLTB:
+            return 200, mock.hltb_search(json.loads(body or b'{}'))
+
+        if upstream == YOUTUBE and parts[-1] == "results":
+            return 200, [{"id": item['id']['videoId']} for item in mock.youtube_search['items']]
+        if upstream == YOUTUBE:
+            return 200, mock.youtube_search
+
+        return 404, {"error": "not found"}
+
+    def __reply(self, status, body, headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain' if isinstance(body, str) else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.wfile.flush()
+
+
+def _number(text):
+    return int(hashlib.md5(str(text).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _select(page):
+    select = page['properties']['Data Fetched']['select']
+    return None if select is None else select['name']
+
+
+def _steamid(page):
+    rich_text = page['properties']['SteamID']['rich_text']
+    return rich_text[0]['plain_text'] if len(rich_text) > 0 else None
+
+
+def _select_values(database_filter):
+    """
+    The select options a filter asks for - the stand-in only understands "Data Fetched equals ..." conditions.
+    """
+    if isinstance(database_filter, dict):
+        for key, value in database_filter.items():
+            if key == "equals" and isinstance(value, str):
+                yield value
+            else:
+                yield from _select_values(value)
+    elif isinstance(database_filter, list):
+        for value in database_filter:
+            yield from _select_values(value)
+
+
+def synthetic_pages(count, steam_share=0.5, option=LOAD_OPTIONS[0], seed=0, database_id=DATABASE_ID):
+    """
+    A database of `count` pages set to `option`, the given share of them with a SteamID, the others with a name only.
+    """
+    rng = random.Random(seed)
+    pages = []
+    for i in range(count):
+        steamid = str(100000 + i * 10) if rng.random() < steam_share else None
+        pages.append({
+            "object": "page",
+            "id": f"00000000-0000-4000-8000-{i:012d}",
+            "parent": {"type": "database_id", "database_id": database_id},
+            "icon": None,
+            "cover": None,
+            "properties": {
+                "Data Fetched": {"type": "select", "select": {"name": option}},
+                "SteamID": {"type": "rich_text", "rich_text": [] if steamid is None else [
+                    {"type": "text", "text": {"content": steamid}, "plain_text": steamid}]},
+                "Name": {"type": "title", "title": [
+                    {"type": "text", "text": {"content": f"Benchmark Game {i}"}, "plain_text": f"Benchmark Game {i}"}]},
+            }
+        })
+    return pages
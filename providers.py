@@ -0,0 +1,96 @@
+"""
+Registry of the sources the game data comes from. Every provider declares the GameData fields it fills, a rough
+cost and the packages it needs - those are only imported once an enabled provider is first used, so a deployment
+without HLTB or a YouTube API key never loads them. List the providers with
+
+    python main.py providers
+"""
+import importlib.util
+import threading
+
+
+# Providers to leave out, e.g. {"hltb", "youtube_scrape"} - their packages need not even be installed then
+DISABLED_PROVIDERS = set()
+
+
+class Provider:
+    """
+    `source` is the schema source the provider belongs to (None for identification), `fetch(gd, pool)` fills the
+    `fields` of a GameData - providers of the same source may share one fetch, which then runs once.
+    `cost` is the rough number of upstream requests per game. `modules` are the top level packages the provider
+    imports on first use, `configured()` tells whether its keys are set. Providers that are not `optional` are
+    needed to identify pages at all and can not be disabled.
+    """
+
+    def __init__(self, name, source, fields, cost, fetch=None, modules=(), configured=None, optional=True):
+        self.name = name
+        self.source = source
+        self.fields = tuple(fields)
+        self.cost = cost
+        self.fetch = fetch
+        self.modules = tuple(modules)
+        self.configured = configured
+        self.optional = optional
+
+        self._installed = None
+
+    def installed(self):
+        """
+        Whether the packages are there - checked without importing them.
+        """
+        if self._installed is None:
+            self._installed = all(importlib.util.find_spec(module) is not None for module in self.modules)
+        return self._installed
+
+    def enabled(self):
+        if not self.optional:
+            return True
+        if self.name in DISABLED_PROVIDERS:
+            return False
+        if self.configured is not None and not self.configured():
+            return False
+        return self.installed()
+
+    def __repr__(self):
+        return f"Provider({self.name!r})"
+
+
+_lock = threading.Lock()
+_providers = {}
+
+
+def register(provider):
+    with _lock:
+        if provider.name in _providers:
+            raise ValueError(f"A provider named {provider.name!r} is registered already")
+        _providers[provider.name] = provider
+    return provider
+
+
+def get(name):
+    with _lock:
+        return _providers[name]
+
+
+def providers():
+    """
+    Every registered provider, in the order they were registered.
+    """
+    with _lock:
+        return list(_providers.values())
+
+
+def enabled(name):
+    return get(name).enabled()
+
+
+def fetches(sources):
+    """
+    The distinct fetches of the enabled providers of the given sources as (source, fetch), the most expensive first
+    so the slowest lookups start right away.
+    """
+    found = {}
+    for provider in sorted(providers(), key=lambda p: p.cost, reverse=True):
+        if provider.fetch is not None and provider.source in sources and provider.enabled():
+            found.setdefault((provider.source, provider.fetch), None)
+    return list(found)
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+
+class FairScheduler:
+    """
+    Runs tasks on a fixed number of worker threads, taking turns between the queues of different keys (e.g. one per
+    database) - so thousands of queued pages of one database do not hold up the few pages of another one.
+    Tasks of the same key run in the order they were submitted.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._threads = []
+
+    def submit(self, key, fn, *args):
+        future = Future()
+        with self._cond:
+            self._queues.setdefault(key, deque()).append((future, fn, args))
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self.__work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._cond.notify()
+        return future
+
+    def map(self, key, fn, items):
+        """
+        Like ThreadPoolExecutor.map, but waits for all results and returns them as a list.
+        """
+        futures = [self.submit(key, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def queued(self, key=None):
+        with self._cond:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return sum(len(queue) for queue in self._queues.values())
+
+    def __work(self):
+        while True:
+            with self._cond:
+                while len(self._queues) == 0:
+                    self._cond.wait()
+                key, queue = next(iter(self._queues.items()))
+                future, fn, args = queue.popleft()
+                # The key goes to the back of the line, the next task is taken from the next key
+                del self._queues[key]
+                if len(queue) > 0:
+                    self._queues[key] = queue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
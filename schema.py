@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+
+# Seconds until the database schema is read again, so added or removed properties are picked up
+SCHEMA_REFRESH_INTERVAL = 15 * 60
+
+# Write description, times, trailer and screenshots into the page body of "Load All" pages
+WRITE_PAGE_BODY = True
+
+IMAGES = "images"
+IGDB = "igdb"
+HLTB = "hltb"
+TRAILER = "trailer"
+
+SOURCES = (IMAGES, IGDB, HLTB, TRAILER)
+
+# The source each optional property is filled from - properties missing from the database are neither written
+# nor fetched
+PROPERTY_SOURCES = {
+    "Genre": IGDB,
+    "Theme": IGDB,
+    "Developer": IGDB,
+    "Publisher": IGDB,
+    "Release date": IGDB,
+    "IGDB Rating": IGDB,
+    "How Long to Beat": HLTB,
+    "Grid": IMAGES,
+}
+
+# Icon and cover are page attributes, so images are needed no matter the properties
+ALWAYS_NEEDED = {IMAGES}
+BODY_SOURCES = {IGDB, HLTB, TRAILER}
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseSchema:
+    """
+    The properties of a database (name -> type), read with `fetch` and re-read every SCHEMA_REFRESH_INTERVAL seconds.
+    Until the schema could be read once, every property is assumed to exist.
+    """
+
+    def __init__(self, fetch, refresh_interval=SCHEMA_REFRESH_INTERVAL, write_page_body=WRITE_PAGE_BODY):
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.write_page_body = write_page_body
+
+        self._lock = threading.Lock()
+        self._properties = None
+        self._fetched_at = None
+
+    def properties(self):
+        """
+        Returns {name: type}, or None if the schema is unknown.
+        """
+        with self._lock:
+            if self._fetched_at is None or time.monotonic() - self._fetched_at >= self.refresh_interval:
+                try:
+                    self._properties = {name: prop['type'] for name, prop in self.fetch()['properties'].items()}
+                except Exception:
+                    logger.exception("Reading the database schema failed, %s",
+                                     "assuming every property exists" if self._properties is None
+                                     else "keeping the previous one")
+                # Also after a failure, so a broken schema request does not slow down every page
+                self._fetched_at = time.monotonic()
+            return self._properties
+
+    def invalidate(self):
+        """
+        Makes the next call read the schema again.
+        """
+        with self._lock:
+            self._fetched_at = None
+
+    def has(self, name):
+        properties = self.properties()
+        return properties is None or name in properties
+
+    def sources(self, page_body=True):
+        """
+        The sources worth fetching for a "Load All" page - without page_body, only those the properties need.
+        """
+        needed = set(ALWAYS_NEEDED)
+        needed.update(source for name, source in PROPERTY_SOURCES.items() if self.has(name))
+        if self.write_page_body and page_body:
+            needed.update(BODY_SOURCES)
+        return needed
+
+    def filter(self, update_data):
+        """
+        Drops the properties the database does not have from a page update - Notion rejects the whole update otherwise.
+        """
+        if 'properties' in update_data:
+            update_data['properties'] = {name: prop for name, prop in update_data['properties'].items()
+                                         if self.has(name)}
+        return update_data
@@ -0,0 +1,152 @@
+"""
+Event-driven trigger mode: a small HTTP endpoint that queues pages as soon as something reports a change.
+
+    POST /trigger              {"page_id": "<id>"}, or a Notion webhook event ({"entity": {"id": "<id>"}, ...})
+    POST /trigger/<page_id>    same, without a body - e.g. from curl or an automation
+    GET /metrics               Prometheus metrics
+
+Only pages of the served databases whose "Data Fetched" property is set to one of the load options are processed.
+The regular poller keeps running at a low frequency as a fallback for missed events.
+
+Send a fake event to a running server with
+    python server.py send <page_id> [--url http://127.0.0.1:8080]
+"""
+import argparse
+import json
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import main
+import metrics
+
+
+# Require "Authorization: Bearer <token>" on every trigger if set
+TRIGGER_TOKEN = ""
+
+# Interval of the fallback poller in server mode (seconds)
+FALLBACK_MIN_POLL_INTERVAL = 5 * 60
+FALLBACK_MAX_POLL_INTERVAL = 15 * 60
+
+LOAD_OPTIONS = (main.LOAD_ALL_OPTION, main.LOAD_IMAGES_OPTION, main.REFRESH_ALL_OPTION)
+
+logger = logging.getLogger(__name__)
+
+
+def page_id_from_event(event):
+    """
+    Accepts {"page_id": ...}, {"id": ...} and Notion webhook events ({"entity": {"id": ..., "type": "page"}}).
+    """
+    if 'page_id' in event:
+        return event['page_id']
+    if 'entity' in event and event['entity'].get('type', 'page') == 'page':
+        return event['entity'].get('id')
+    return event.get('id')
+
+
+def trigger(page_id):
+    """
+    Queues a page if it is set to one of the load options. Returns whether it was queued.
+    """
+    game = main.fetch_page(page_id)
+
+    database = main.served_databases.of_page(game)
+    if database is None:
+        return False
+
+    # Pages of a database without the property (or renamed) are simply not ours to process
+    select = game['properties'].get('Data Fetched', {}).get('select')
+    if select is None or select['name'] not in LOAD_OPTIONS:
+        return False
+
+    main.page_pool.submit(database, [game])
+    return True
+
+
+class TriggerHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip('/') == "/metrics":
+            metrics.respond_metrics(self)
+        else:
+            self.__respond(404, {"error": "not found"})
+
+    def do_POST(self):
+        if TRIGGER_TOKEN and self.headers.get('Authorization') != f'Bearer {TRIGGER_TOKEN}':
+            self.__respond(401, {"error": "unauthorized"})
+            return
+
+        match = re.fullmatch(r'/trigger(?:/([0-9a-fA-F-]+))?/?', self.path)
+        if match is None:
+            self.__respond(404, {"error": "not found"})
+            return
+
+        page_id = match.group(1)
+        if page_id is None:
+            try:
+                event = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError:
+                self.__respond(400, {"error": "invalid json"})
+                return
+
+            # Notion sends a one-time verification token when a webhook subscription is created
+            if 'verification_token' in event:
+                logger.info("Webhook verification token: %s", event['verification_token'])
+                self.__respond(200, {})
+                return
+
+            page_id = page_id_from_event(event)
+            if page_id is None:
+                self.__respond(400, {"error": "no page id"})
+                return
+
+        try:
+            queued = trigger(page_id)
+        except requests.RequestException as e:
+            self.__respond(502, {"error": str(e)})
+            return
+
+        self.__respond(202 if queued else 200, {"page_id": page_id, "queued": queued})
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def __respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host, port):
+    poller = main.Poller(min_interval=FALLBACK_MIN_POLL_INTERVAL, max_interval=FALLBACK_MAX_POLL_INTERVAL)
+    threading.Thread(target=poller.run, daemon=True).start()
+
+    httpd = ThreadingHTTPServer((host, port), TriggerHandler)
+    logger.info("Listening for triggers on %s:%s", host, port)
+    httpd.serve_forever()
+
+
+def send(page_id, url, token=TRIGGER_TOKEN):
+    """
+    Fake event sender for testing a running server.
+    """
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    return requests.post(f'{url}/trigger', json={"page_id": page_id}, headers=headers, timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sends a trigger event to a running server.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    send_parser = subparsers.add_parser("send", help="trigger a single page")
+    send_parser.add_argument("page_id")
+    send_parser.add_argument("--url", default="http://127.0.0.1:8080")
+    args = parser.parse_args()
+
+    r = send(args.page_id, args.url)
+    print(r.status_code, r.text)
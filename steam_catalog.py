@@ -0,0 +1,308 @@
+"""
+Offline index of the Steam app list, for resolving names to appids without asking any API.
+
+Build (or incrementally update) the index from a dump of https://api.steampowered.com/ISteamApps/GetAppList/v2/
+    python steam_catalog.py download
+    python steam_catalog.py build [path/to/applist.json]
+and try it with
+    python steam_catalog.py lookup "Hollow Knight"
+"""
+import argparse
+import bisect
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+
+import http_client
+import storage
+
+
+APP_LIST_URL = "https://api.steampowered.com/ISteamApps/GetAppList/v2/"
+APP_LIST_FILE = "steam_applist.json"
+INDEX_FILE = "steam_catalog.idx"
+
+# Minimum trigram similarity (0 - 1) for a fuzzy match - a wrong match is worse than none
+MIN_SIMILARITY = 0.75
+
+# Read as sequel numbers next to digits - "i" is left out, it is far more often the word than the numeral
+ROMAN_NUMERALS = {"ii": 2, "iii": 3, "iv": 4, "v": 5, "vi": 6, "vii": 7, "viii": 8, "ix": 9, "x": 10,
+                  "xi": 11, "xii": 12, "xiii": 13, "xiv": 14, "xv": 15, "xvi": 16}
+
+# Candidates to score exactly after the rough pass over the rarest trigrams of a name
+FUZZY_CANDIDATES = 20
+RARE_TRIGRAMS = 6
+
+# Dropped from names before they are normalized, like main.cleanup_name does
+TRADEMARK_SIGNS = (u"™", u"®", u"℠")
+
+# Bumped whenever normalize_title changes, so indexes with names normalized differently are rebuilt
+_MAGIC = b"SAPPIDX2"
+_ALPHABET = " abcdefghijklmnopqrstuvwxyz0123456789"
+_CHAR_CODES = {c: i for i, c in enumerate(_ALPHABET)}
+_TRIGRAM_COUNT = len(_ALPHABET) ** 3
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_title(name):
+    """
+    Lowercase ASCII letters and digits separated by single spaces. Trademark signs are dropped first - NFKD would
+    turn them into letters glued to the word before them.
+
+    >>> normalize_title("DARK SOULS™ III") == normalize_title("Dark Souls III")
+    True
+    >>> normalize_title("Portal 2™")
+    'portal 2'
+    """
+    for mark in TRADEMARK_SIGNS:
+        name = name.replace(mark, "")
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    return re.sub(r'[^a-z0-9]+', ' ', name).strip()
+
+
+def numbers(normalized):
+    """
+    The numbers in a normalized name, roman numerals included - a fuzzy match must have exactly the same ones, as
+    the names of sequels are as similar as names can get.
+
+    >>> numbers("dark souls iii") == numbers("dark souls 3")
+    True
+    >>> numbers("forza horizon 3") == numbers("forza horizon 5")
+    False
+    """
+    return Counter(ROMAN_NUMERALS[token] if token in ROMAN_NUMERALS else int(token)
+                   for token in normalized.split() if token in ROMAN_NUMERALS or token.isdigit())
+
+
+def trigrams(normalized):
+    padded = f" {normalized} "
+    return {(_CHAR_CODES[padded[i]] * len(_ALPHABET) + _CHAR_CODES[padded[i + 1]]) * len(_ALPHABET)
+            + _CHAR_CODES[padded[i + 2]] for i in range(len(padded) - 2)}
+
+
+class _Names:
+    """
+    Sequence view over the concatenated names, so bisect works without a list of 150k strings.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode('ascii')
+
+
+class SteamCatalog:
+    """
+    Array-backed index of (normalized name, appid), sorted by name, with a trigram index for fuzzy lookups.
+    Memory use is a handful of flat arrays, loading is a few bulk reads.
+    """
+
+    def __init__(self, appids, name_offsets, names_blob, trigram_offsets, postings):
+        self.appids = appids
+        self.name_offsets = name_offsets
+        self.names = _Names(names_blob, name_offsets)
+        self.trigram_offsets = trigram_offsets
+        self.postings = postings
+
+    def __len__(self):
+        return len(self.appids)
+
+    @classmethod
+    def build(cls, apps, base=None):
+        """
+        Builds the index from (appid, name) pairs. With a base index, only apps it does not know yet are added.
+        """
+        entries = {}
+        known = set()
+        if base is not None:
+            for i in range(len(base)):
+                entries.setdefault(base.names[i], base.appids[i])
+                known.add(base.appids[i])
+
+        for appid, name in apps:
+            if appid in known:
+                continue
+            normalized = normalize_title(name)
+            if normalized == "":
+                continue
+            # Soundtracks, DLC and demos usually share the name of the game and come later - prefer the lowest appid
+            if normalized not in entries or appid < entries[normalized]:
+                entries[normalized] = appid
+
+        names = sorted(entries)
+        appids = array('I', (entries[name] for name in names))
+
+        name_offsets = array('I', [0])
+        blob = bytearray()
+        per_trigram = [[] for _ in range(_TRIGRAM_COUNT)]
+        for i, name in enumerate(names):
+            blob += name.encode('ascii')
+            name_offsets.append(len(blob))
+            for trigram in trigrams(name):
+                per_trigram[trigram].append(i)
+
+        trigram_offsets = array('I', [0])
+        postings = array('I')
+        for entries_of_trigram in per_trigram:
+            postings.extend(entries_of_trigram)
+            trigram_offsets.append(len(postings))
+
+        return cls(appids, name_offsets, bytes(blob), trigram_offsets, postings)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a Steam catalog index")
+            sizes = struct.unpack('<5Q', f.read(5 * 8))
+            arrays = []
+            for typecode, size in zip('IIBII', sizes):
+                a = array(typecode)
+                a.frombytes(f.read(size * a.itemsize))
+                arrays.append(a)
+
+        appids, name_offsets, blob, trigram_offsets, postings = arrays
+        return cls(appids, name_offsets, blob.tobytes(), trigram_offsets, postings)
+
+    def save(self, path):
+        blob = array('B', self.names.blob)
+        arrays = [self.appids, self.name_offsets, blob, self.trigram_offsets, self.postings]
+        with open(path + '.tmp', 'wb') as f:
+            f.write(_MAGIC)
+            f.write(struct.pack('<5Q', *(len(a) for a in arrays)))
+            for a in arrays:
+                a.tofile(f)
+        os.replace(path + '.tmp', path)
+
+    def lookup(self, name):
+        """
+        Returns the appid of the best match, or None if nothing is similar enough.
+
+        >>> index = SteamCatalog.build([(400, "Portal"), (620, "Portal 2"), (70, "Half-Life"),
+        ...                             (1551360, "Forza Horizon 5"), (292030, "The Witcher 3: Wild Hunt")])
+        >>> index.lookup("Portal 2™"), index.lookup("Witcher 3: Wild Hunt")
+        (620, 292030)
+        >>> index.lookup("Portal 3") is None, index.lookup("Half-Life 3") is None
+        (True, True)
+        >>> index.lookup("Forza Horizon 3") is None
+        True
+        """
+        normalized = normalize_title(name)
+        if normalized == "":
+            return None
+
+        i = bisect.bisect_left(self.names, normalized)
+        if i < len(self) and self.names[i] == normalized:
+            return self.appids[i]
+
+        return self.__fuzzy_lookup(normalized)
+
+    def __fuzzy_lookup(self, normalized):
+        query = trigrams(normalized)
+
+        # Rough pass: count hits on the rarest trigrams only, common ones ("the", " of") hardly narrow anything down
+        rare = sorted(query, key=lambda t: self.trigram_offsets[t + 1] - self.trigram_offsets[t])[:RARE_TRIGRAMS]
+        hits = Counter()
+        for trigram in rare:
+            hits.update(self.postings[self.trigram_offsets[trigram]:self.trigram_offsets[trigram + 1]])
+
+        query_numbers = numbers(normalized)
+        best, best_similarity = None, MIN_SIMILARITY
+        for i, _ in hits.most_common(FUZZY_CANDIDATES):
+            if numbers(self.names[i]) != query_numbers:
+                continue
+            candidate = trigrams(self.names[i])
+            similarity = len(query & candidate) / len(query | candidate)
+            if similarity >= best_similarity:
+                best, best_similarity = self.appids[i], similarity
+        return best
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def catalog():
+    """
+    The index in the data directory, loaded on first use. None if it was never built.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            path = storage.data_path(INDEX_FILE)
+            if os.path.exists(path):
+                try:
+                    _catalog = SteamCatalog.load(path)
+                except ValueError:
+                    logger.warning("The Steam catalog index is outdated, rebuild it with "
+                                   "python steam_catalog.py download")
+        return _catalog
+
+
+def lookup(name):
+    index = catalog()
+    return None if index is None else index.lookup(name)
+
+
+def read_app_list(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(app['appid'], app['name']) for app in json.load(f)['applist']['apps']]
+
+
+def download_app_list(path):
+    r = http_client.steam().get(APP_LIST_URL, timeout=(5, 120))
+    r.raise_for_status()
+    with open(path, 'wb') as f:
+        f.write(r.content)
+
+
+def rebuild(app_list_path, full=False):
+    """
+    Adds the apps of a dump to the index in the data directory (or rebuilds it from scratch) and returns it.
+    """
+    global _catalog
+    index_path = storage.data_path(INDEX_FILE)
+    base = None
+    if not full and os.path.exists(index_path):
+        try:
+            base = SteamCatalog.load(index_path)
+        except ValueError:
+            pass  # written by an older version, rebuilt from scratch
+
+    index = SteamCatalog.build(read_app_list(app_list_path), base)
+    index.save(index_path)
+    with _catalog_lock:
+        _catalog = index
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds and queries the offline Steam app index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    download_parser = subparsers.add_parser("download", help="download the current app list and add it to the index")
+    download_parser.add_argument("--full", action="store_true", help="rebuild the index from scratch")
+    build_parser = subparsers.add_parser("build", help="add an app list dump to the index")
+    build_parser.add_argument("app_list", nargs="?", default=None)
+    build_parser.add_argument("--full", action="store_true", help="rebuild the index from scratch")
+    lookup_parser = subparsers.add_parser("lookup", help="resolve a name to an appid")
+    lookup_parser.add_argument("name")
+    args = parser.parse_args()
+
+    if args.command == "lookup":
+        print(lookup(args.name))
+    else:
+        app_list = getattr(args, 'app_list', None) or storage.data_path(APP_LIST_FILE)
+        if args.command == "download":
+            download_app_list(app_list)
+        print(f"{len(rebuild(app_list, args.full))} apps indexed")
@@ -0,0 +1,125 @@
+import json
+import threading
+from urllib.parse import quote
+
+import http_client
+from cache import cache, normalize
+
+
+GRID_BASE_URL = "https://www.steamgriddb.com/api/v2"
+
+# Steam appids per multi-id request, e.g. /icons/steam/1,2,3
+MULTI_ID_MAX = 50
+
+
+def pick_image(image_type, images):
+    """
+    Returns [url, author] of the image to use, or None if there is none.
+    """
+    if len(images) == 0:
+        return None
+
+    # edge case to prefer higher res icons over the first ones
+    if image_type == 'icons':
+        icons_filtered = list(filter(lambda icon: icon['width'] >= 64, images))
+        item = images[0] if len(icons_filtered) == 0 else icons_filtered[0]
+    else:
+        item = images[0]
+
+    return [item['url'], item['author']['name']]
+
+
+def _cache_key(image_type, platform, game_id, params):
+    return f"{image_type}:{platform}:{game_id}:{json.dumps(params, sort_keys=True)}"
+
+
+def search_id(name, refresh=False):
+    """
+    Returns the SteamGrid game id of the best autocomplete match, or None.
+    """
+    def fetch():
+        r = http_client.steamgrid().get(f'{GRID_BASE_URL}/search/autocomplete/{quote(name, safe="")}')
+        if r.status_code != 200:
+            return None
+        data = r.json()
+        if not data['success'] or len(data['data']) == 0:
+            return None
+        return data['data'][0]['id']
+
+    return cache.get_or_fetch("steamgrid_id", normalize(name), fetch, refresh)
+
+
+def image_by_game_id(image_type, steamgrid_id, params, refresh=False):
+    def fetch():
+        r = http_client.steamgrid().get(f'{GRID_BASE_URL}/{image_type}/game/{steamgrid_id}', params=params)
+        if r.status_code != 200:
+            return None
+        data = r.json()
+        if not data['success']:
+            return None
+        return pick_image(image_type, data['data'])
+
+    return cache.get_or_fetch("steamgrid_image", _cache_key(image_type, "game", steamgrid_id, params), fetch, refresh)
+
+
+class ImageBatch:
+    """
+    Looks up images of many Steam games at once with SteamGrid's comma-separated multi-id requests.
+    Call prefetch() with the appids of a batch, then image_by_steam_appid() for each of them.
+    Appids that were not prefetched are looked up on demand.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._images = {}
+
+    def prefetch(self, image_type, appids, params, refresh_appids=()):
+        refresh_appids = {str(appid) for appid in refresh_appids}
+        pending = []
+        for appid in dict.fromkeys(str(appid) for appid in appids):
+            key = _cache_key(image_type, "steam", appid, params)
+            cached = None if appid in refresh_appids else cache.get("steamgrid_image", key)
+            if cached is not None:
+                with self._lock:
+                    self._images[key] = cached
+            else:
+                pending.append(appid)
+
+        for i in range(0, len(pending), MULTI_ID_MAX):
+            self.__fetch(image_type, pending[i:i + MULTI_ID_MAX], params)
+
+    def image_by_steam_appid(self, image_type, appid, params, refresh=False):
+        """
+        Returns [url, author] or None.
+        """
+        key = _cache_key(image_type, "steam", appid, params)
+        with self._lock:
+            if key in self._images:
+                return self._images[key]
+
+        cached = None if refresh else cache.get("steamgrid_image", key)
+        if cached is not None:
+            return cached
+        self.__fetch(image_type, [str(appid)], params)
+
+        with self._lock:
+            return self._images.get(key)
+
+    def __fetch(self, image_type, appids, params):
+        r = http_client.steamgrid().get(f'{GRID_BASE_URL}/{image_type}/steam/{",".join(appids)}', params=params)
+
+        images = {appid: None for appid in appids}
+        if r.status_code == 200:
+            data = r.json()
+            if data['success']:
+                # A single id is answered like a normal request, several ids with one result per id, in order
+                results = [data] if len(appids) == 1 else data['data']
+                for appid, result in zip(appids, results):
+                    if result.get('success'):
+                        images[appid] = pick_image(image_type, result['data'])
+
+        with self._lock:
+            for appid, image in images.items():
+                key = _cache_key(image_type, "steam", appid, params)
+                self._images[key] = image
+                cache.set("steamgrid_image", key, image)
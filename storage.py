@@ -0,0 +1,33 @@
+import json
+import os
+import threading
+
+
+# Everything the tool persists between restarts lives here - mount it as a volume when running in docker
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+
+_write_lock = threading.Lock()
+
+
+def data_path(filename):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
+
+
+def load_json(filename, default=None):
+    try:
+        with open(data_path(filename), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(filename, data):
+    """
+    Writes to a temporary file first so a crash mid-write never leaves a truncated file behind.
+    """
+    path = data_path(filename)
+    with _write_lock:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
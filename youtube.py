@@ -0,0 +1,133 @@
+import threading
+import time
+
+import config
+import http_client
+import storage
+from cache import cache, normalize
+
+
+# The YouTube Data API grants 10k units per day (reset at midnight Pacific Time), a search costs 100 of them
+DAILY_QUOTA = 10000
+SEARCH_COST = 100
+
+# Units left untouched, so other tools sharing the key are not locked out - scraping is used instead
+QUOTA_RESERVE = 500
+
+QUOTA_FILE = "youtube_quota.json"
+
+# Base URL of the Data API, None for the one in the discovery document
+API_ENDPOINT = None
+
+# The scraper, imported on first use - see scraper()
+YoutubeSearch = None
+
+# Pacific Standard Time - close enough for deciding which quota day we are on
+QUOTA_DAY_UTC_OFFSET = -8 * 60 * 60
+
+
+def scraper():
+    global YoutubeSearch
+    if YoutubeSearch is None:
+        from youtube_search import YoutubeSearch
+    return YoutubeSearch
+
+
+def _quota_day():
+    return time.strftime('%Y-%m-%d', time.gmtime(time.time() + QUOTA_DAY_UTC_OFFSET))
+
+
+class YoutubeSearchService:
+    """
+    Process-wide YouTube search. The API client is built once from the discovery document bundled with
+    google-api-python-client, results are cached per query, and the scraper takes over before the quota runs out.
+    google-api-python-client is only imported with the first API search, so it costs nothing without a key.
+    """
+
+    def __init__(self, api_key=config.YT_API_KEY, quota_file=QUOTA_FILE):
+        self.api_key = api_key
+        self.quota_file = quota_file
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._youtube = None
+
+        quota = storage.load_json(quota_file, {})
+        self._quota_day = quota.get('day', _quota_day())
+        self._quota_used = quota.get('used', 0)
+
+    def trailer_id(self, name, refresh=False, api=True, scrape=True):
+        """
+        Returns the video id of the game's trailer, or None.
+        """
+        if not api and not scrape:
+            return None
+        query = f'{name} Trailer'
+        return cache.get_or_fetch("youtube", normalize(query), lambda: self.search(query, api, scrape), refresh)
+
+    def search(self, query, api=True, scrape=True):
+        if api and self.api_key != "" and self.__reserve_quota():
+            import googleapiclient.errors
+            try:
+                return self.__search_api(query)
+            except googleapiclient.errors.HttpError as e:
+                if e.resp.status == 403:
+                    self.__exhaust_quota()
+
+        if not scrape:
+            return None
+        with http_client.limit(http_client.YOUTUBE):
+            results = scraper()(query, max_results=1, timeout=http_client.TIMEOUT).to_dict()
+        if len(results) > 0:
+            return results[0]['id']
+        return None
+
+    def quota_used(self):
+        with self._lock:
+            return self._quota_used
+
+    def __search_api(self, query):
+        import googleapiclient.discovery
+        import httplib2
+
+        with self._lock:
+            if self._youtube is None:
+                self._youtube = googleapiclient.discovery.build('youtube', 'v3', developerKey=self.api_key,
+                                                                static_discovery=True, cache_discovery=False,
+                                                                client_options={'api_endpoint': API_ENDPOINT})
+            youtube = self._youtube
+
+        # The http object of the client is not thread-safe, so every thread gets its own
+        if not hasattr(self._local, 'http'):
+            self._local.http = httplib2.Http(timeout=http_client.TIMEOUT[1])
+
+        yt_req = youtube.search().list(q=query, part='id', type='video', maxResults=1)
+        with http_client.limit(http_client.YOUTUBE):
+            items = yt_req.execute(http=self._local.http)['items']
+        if len(items) == 0:
+            return None
+        return items[0]['id']['videoId']
+
+    def __reserve_quota(self):
+        with self._lock:
+            if self._quota_day != _quota_day():
+                self._quota_day = _quota_day()
+                self._quota_used = 0
+
+            if self._quota_used + SEARCH_COST > DAILY_QUOTA - QUOTA_RESERVE:
+                return False
+
+            self._quota_used += SEARCH_COST
+            self.__save()
+            return True
+
+    def __exhaust_quota(self):
+        with self._lock:
+            self._quota_used = DAILY_QUOTA
+            self.__save()
+
+    def __save(self):
+        storage.save_json(self.quota_file, {'day': self._quota_day, 'used': self._quota_used})
+
+
+search_service = YoutubeSearchService()